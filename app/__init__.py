@@ -11,28 +11,72 @@
 #-----------------------------------------------------------------------------#
 # Setup
 #-----------------------------------------------------------------------------#
-from flask import Flask, send_from_directory
-from flask.ext.sqlalchemy import SQLAlchemy 
-from flask.ext.restful import Api
+from flask import Flask
 
+from database import SQLAlchemy
 
-app = Flask(__name__, )
-app.config.from_pyfile('config/main.py')
 
-db = SQLAlchemy(app)
-api = Api(app)
+db = SQLAlchemy()
+
+
+def create_app(config_file='config/main.py', **settings):
+    """Create the application. Settings are read from app/config/default.py,
+    then config_file and then any keyword arguments.
+
+    The views, and Whoosh's query parser with them, are only imported here so
+    that importing the package (e.g. from manage.py or the deamons) is cheap.
+    """
+    app = Flask(__name__)
+    app.config.from_object('app.config.default')
+    if config_file:
+        app.config.from_pyfile(config_file)
+    app.config.update(settings)
+    if app.config['MAX_CONTENT_LENGTH'] is None:
+        # A character can take 12 bytes of JSON, as a surrogate pair of \u
+        # escapes, plus room for the title and tags
+        app.config['MAX_CONTENT_LENGTH'] = \
+            12 * app.config['DOCUMENT_MAX_LENGTH'] + 64 * 1024
+
+    db.init_app(app)
+    # Lets the models be used outside of a request, e.g. by the deamons
+    db.app = app
+
+    from profiling import init_profiling
+    init_profiling(app)
+    register_routes(app)
+    return app
+
+
+def warm_up(app):
+    """Open the index and fill the caches that requests use, so that a worker
+    can do this before it takes any traffic. Returns how long each step took,
+    in ms."""
+    from views.api_v1 import warm_up_caches
+    with app.test_request_context():
+        return warm_up_caches()
+
 
 #-----------------------------------------------------------------------------#
 # Register API Routes
 #-----------------------------------------------------------------------------#
-from views.api_v1 import DocumentAPI, DocumentListAPI, PingAPI, TagAPI,\
-    TagListAPI, DocumentTagAPI, IndexAPI, SearchAPI
-
-api.add_resource(PingAPI, '/api/v1.0/ping', '/api/v1.0/ping/')
-api.add_resource(DocumentAPI, '/api/v1.0/document/<int:id>', endpoint='document')
-api.add_resource(DocumentListAPI, '/api/v1.0/document', '/api/v1.0/document/')
-api.add_resource(TagAPI, '/api/v1.0/tag/<int:id>', endpoint='tag')
-api.add_resource(TagListAPI, '/api/v1.0/tag', '/api/v1.0/tag/')
-api.add_resource(DocumentTagAPI, '/api/v1.0/document/<int:doc_id>/tag/<int:tag_id>')
-api.add_resource(IndexAPI, '/api/v1.0/index')
-api.add_resource(SearchAPI, '/api/v1.0/document/search')
+def register_routes(app):
+    from flask.ext.restful import Api
+    from views.api_v1 import DocumentAPI, DocumentListAPI, PingAPI, TagAPI,\
+        TagListAPI, DocumentTagAPI, TagDocumentsAPI, IndexAPI, SearchAPI,\
+        SuggestAPI, StatsAPI
+
+    api = Api(app)
+    api.add_resource(PingAPI, '/api/v1.0/ping', '/api/v1.0/ping/')
+    api.add_resource(StatsAPI, '/api/v1.0/stats')
+    api.add_resource(DocumentAPI, '/api/v1.0/document/<int:id>',
+                     endpoint='document')
+    api.add_resource(DocumentListAPI, '/api/v1.0/document',
+                     '/api/v1.0/document/')
+    api.add_resource(TagAPI, '/api/v1.0/tag/<int:id>', endpoint='tag')
+    api.add_resource(TagListAPI, '/api/v1.0/tag', '/api/v1.0/tag/')
+    api.add_resource(DocumentTagAPI,
+                     '/api/v1.0/document/<int:doc_id>/tag/<int:tag_id>')
+    api.add_resource(TagDocumentsAPI, '/api/v1.0/tag/<int:tag_id>/documents')
+    api.add_resource(IndexAPI, '/api/v1.0/index')
+    api.add_resource(SearchAPI, '/api/v1.0/document/search')
+    api.add_resource(SuggestAPI, '/api/v1.0/suggest')
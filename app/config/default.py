@@ -0,0 +1,87 @@
+# Default values for settings that do not need to be set in main.py. Anything
+# set in main.py will override the values here.
+
+# Database connection pool. None leaves the setting to Flask-SQLAlchemy and
+# the driver. Each web and index deamon worker process has its own pool.
+SQLALCHEMY_POOL_SIZE = None # Connections kept open
+SQLALCHEMY_MAX_OVERFLOW = None # Extra connections opened when busy
+SQLALCHEMY_POOL_TIMEOUT = None # Seconds to wait for a connection
+SQLALCHEMY_POOL_RECYCLE = None # Seconds before a connection is reopened
+SQLALCHEMY_POOL_PRE_PING = False # Test connections before they are used
+# Key in SQLALCHEMY_BINDS of a read replica that the read-only endpoints
+# (getting and listing documents and tags) query instead.
+SQLALCHEMY_BINDS = None
+SQLALCHEMY_READ_BIND = None
+
+# Number of shards the index is split over. Searches score hits with the term
+# statistics of all the shards, so results rank as they would in one index.
+WHOOSH_INDEX_SHARDS = 1
+
+# Set WHOOSH_PUBLISH_DIR to have the index deamon publish a copy of the index
+# at most every INDEX_PUBLISH_PERIOD seconds. Search nodes sync the copies to
+# WHOOSH_REPLICA_DIR and serve searches from there if it is set.
+WHOOSH_PUBLISH_DIR = None
+WHOOSH_REPLICA_DIR = None
+WHOOSH_KEEP_GENERATIONS = 3 # Number of published generations kept on disk
+WHOOSH_SYNC_INTERVAL = 5 # Seconds between syncs and replica manifest checks
+
+# Text stored in the index for search snippets. 'full' keeps all of it, 'zlib'
+# keeps it compressed and 'snippet' keeps the first INDEX_SNIPPET_LENGTH
+# characters. The full text is always indexed, and documents pick up a change
+# when they are next indexed.
+INDEX_STORED_TEXT = 'full'
+INDEX_SNIPPET_LENGTH = 2000
+
+# Compress document text in the database when it is at least
+# DB_COMPRESS_MIN_LENGTH characters. Rows are read whether or not they are
+# compressed, so this can be changed without a migration.
+DB_COMPRESS_TEXT = False
+DB_COMPRESS_MIN_LENGTH = 1024
+
+DOCUMENT_MAX_LENGTH = 1000000 # Max characters in a document's text
+# Max bytes in a request body. None works it out from DOCUMENT_MAX_LENGTH so
+# that a document at the limit is never refused for its size in JSON.
+MAX_CONTENT_LENGTH = None
+
+PURGE_DELETED_AFTER = 30 # Days before deleted documents are purged
+
+QUERY_CACHE_SIZE = 1024 # Number of parsed queries to keep
+
+# Fields searched by terms that don't name a field, and their boosts
+SEARCH_FIELDS = {'title': 2.0, 'text': 1.0}
+# Weighting model used to score hits (bm25f, tf_idf, frequency or pl2). It can
+# be changed for a request with the scoring arg. WEIGHTING_OPTIONS are passed
+# to the models, e.g. B (length normalisation) and K1 (term frequency
+# saturation) for bm25f. Field lengths are recorded when documents are
+# indexed, so changing these doesn't need a reindex.
+SEARCH_WEIGHTING = 'bm25f'
+WEIGHTING_OPTIONS = {'bm25f': {'B': 0.75, 'K1': 1.2},
+                     'pl2': {'c': 1.0}}
+
+# Also build the suggestion dictionary when warming up a new worker
+WARM_UP_SUGGEST = False
+# Min seconds between rebuilding the suggestion dictionary in the background
+# after the index changes. Suggestions are served from the old one meanwhile.
+SUGGEST_REBUILD_INTERVAL = 30
+
+# Profiling. When PROFILE_ENABLED is set, requests to PROFILE_ENDPOINTS that
+# have the PROFILE_HEADER header, or are picked at PROFILE_SAMPLE_RATE (0 to
+# 1), are profiled and the stats are written to PROFILE_DIR. The index deamon
+# profiles its batches at the same rate.
+PROFILE_ENABLED = False
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_HEADER = 'X-Searchr-Profile'
+PROFILE_DIR = '/tmp/searchr/profiles'
+PROFILE_ENDPOINTS = ['searchapi', 'documentlistapi']
+
+SLOW_QUERY_LOG = None # File to log searches slower than SLOW_QUERY_THRESHOLD
+SLOW_QUERY_THRESHOLD = 500 # ms
+
+# Index deamon
+INDEX_WORKERS = 2 # Processes fetching and preparing documents
+INDEX_WRITER_PROCS = 1 # Processes analysing documents when writing a shard
+INDEX_BATCH_SIZE = 100 # Max documents written in one commit
+INDEX_WORKER_TIMEOUT = 300 # Seconds before a batch is abandoned and retried
+INDEX_MAX_RETRIES = 5 # Times a document is retried before it is failed
+INDEX_RETRY_BACKOFF = 1 # Seconds before the first retry, doubling each time
+INDEX_PUBLISH_PERIOD = 60 # Min seconds between publishing index generations
@@ -2,8 +2,21 @@ SECRET_KEY = '' # Add a randomly generated secret key
 DEBUG = False
 
 SQLALCHEMY_DATABASE_URI = '' # Connection details for the Database
+# Uncomment to tune the connection pool for each worker process
+# SQLALCHEMY_POOL_SIZE = 5
+# SQLALCHEMY_MAX_OVERFLOW = 10
+# SQLALCHEMY_POOL_RECYCLE = 3600
+# SQLALCHEMY_POOL_PRE_PING = True
+# Uncomment to send read-only requests to a read replica
+# SQLALCHEMY_BINDS = {'replica': ''} # Connection details for the replica
+# SQLALCHEMY_READ_BIND = 'replica'
 WHOOSH_INDEX_DIR = '' # Full path to where should the Whoosh indexes be stored
 
 INDEX_QUEUE = 'index'
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
+WHOOSH_INDEX_SHARDS = 1 # Number of indexes documents are partitioned over
+
+# Uncomment to serve searches from published copies of the index
+# WHOOSH_PUBLISH_DIR = '' # Where the index deamon publishes index generations
+# WHOOSH_REPLICA_DIR = '' # Where search nodes sync the published index to
@@ -0,0 +1,138 @@
+"""
+    Searchr Database
+    ----------------
+
+    Flask-SQLAlchemy with more control over the connection pool, a record of
+    how long checkouts wait for a connection and a session for a read replica.
+"""
+import time
+from threading import Lock
+
+from flask.ext.sqlalchemy import SQLAlchemy as BaseSQLAlchemy, \
+    connection_stack
+from sqlalchemy import exc, orm
+from sqlalchemy.pool import QueuePool
+
+
+#-----------------------------------------------------------------------------#
+# Pool
+#-----------------------------------------------------------------------------#
+class PoolStats(object):
+    """Counts checkouts from a pool and how long they waited, in ms."""
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = Lock()
+
+    def record(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def as_dict(self):
+        with self._lock:
+            return {'checkouts': self.checkouts,
+                    'wait_total': self.wait_total,
+                    'wait_max': self.wait_max,
+                    'wait_mean': self.wait_total / self.checkouts
+                                 if self.checkouts else 0.0}
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waits, including the
+    time taken to open a new connection."""
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return QueuePool._do_get(self)
+        finally:
+            self.stats.record((time.time() - start) * 1000)
+
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """Check a connection is still alive when it is checked out. If it isn't
+    the pool throws it away and tries a new one, so connections broken by a
+    database restart or failover are never handed out."""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("SELECT 1")
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+
+#-----------------------------------------------------------------------------#
+# Extension
+#-----------------------------------------------------------------------------#
+class SQLAlchemy(BaseSQLAlchemy):
+    """Adds the SQLALCHEMY_MAX_OVERFLOW, SQLALCHEMY_POOL_PRE_PING and
+    SQLALCHEMY_READ_BIND settings. Pools (other than SQLite's) are
+    :class:`TimedQueuePool`s so their checkout waits can be reported."""
+    def __init__(self, app=None, **kwargs):
+        self.read_session = orm.scoped_session(
+            self._make_read_session, scopefunc=connection_stack.__ident_func__)
+        BaseSQLAlchemy.__init__(self, app, **kwargs)
+
+    def init_app(self, app):
+        BaseSQLAlchemy.init_app(self, app)
+        teardown = getattr(app, 'teardown_appcontext', app.teardown_request)
+
+        @teardown
+        def shutdown_read_session(exc):
+            self.read_session.remove()
+
+    def apply_pool_defaults(self, app, options):
+        BaseSQLAlchemy.apply_pool_defaults(self, app, options)
+        if app.config['SQLALCHEMY_MAX_OVERFLOW'] is not None:
+            options['max_overflow'] = app.config['SQLALCHEMY_MAX_OVERFLOW']
+        if app.config['SQLALCHEMY_POOL_PRE_PING']:
+            options['pool_events'] = [(ping_connection, 'checkout')]
+
+    def apply_driver_hacks(self, app, info, options):
+        BaseSQLAlchemy.apply_driver_hacks(self, app, info, options)
+        if info.drivername == 'sqlite':
+            # SQLite doesn't use a QueuePool so can't overflow
+            options.pop('max_overflow', None)
+        else:
+            options.setdefault('poolclass', TimedQueuePool)
+
+    def _read_engine(self):
+        app = self.get_app()
+        return self.get_engine(app, bind=app.config['SQLALCHEMY_READ_BIND'])
+
+    def _make_read_session(self):
+        return orm.Session(bind=self._read_engine(), autoflush=False)
+
+    def read_query(self, model):
+        """Return a query for model that reads from the SQLALCHEMY_READ_BIND
+        replica if there is one, otherwise the same as model.query. Only use
+        it for requests that don't write."""
+        if not self.get_app().config['SQLALCHEMY_READ_BIND']:
+            return model.query
+        return model.query_class(model, session=self.read_session())
+
+    def pool_stats(self):
+        """Return the size and checkout waits of the pool for the database and
+        for the read replica, if there is one."""
+        app = self.get_app()
+        engines = {'default': self.engine}
+        if app.config['SQLALCHEMY_READ_BIND']:
+            engines['read'] = self._read_engine()
+        stats = {}
+        for name, engine in engines.iteritems():
+            pool = engine.pool
+            stats[name] = {'pool': pool.__class__.__name__,
+                           'status': pool.status()}
+            if isinstance(pool, TimedQueuePool):
+                stats[name].update(pool.stats.as_dict())
+                stats[name].update({'size': pool.size(),
+                                    'checked_out': pool.checkedout(),
+                                    'overflow': pool.overflow()})
+        return stats
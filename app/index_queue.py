@@ -0,0 +1,109 @@
+"""
+    Searchr Index Queue
+    -------------------
+
+    A reliable queue of document ids waiting to be indexed.
+
+    Uses the same Redis key and serializer as HotQueue, so it can read ids put
+    on the queue by HotQueue. Ids are moved to a processing list when they are
+    reserved and are only removed once they have been acked, so nothing is
+    lost if the index deamon dies part way through a batch.
+"""
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import time
+
+from redis import StrictRedis
+
+
+class IndexQueue(object):
+    """FIFO queue of document ids.
+
+    :param name: the queue name, the Redis key is the same as HotQueue's.
+    :param max_retries: number of times an id is retried before it is moved
+        to the failed list.
+    :param backoff: seconds to wait before the first retry, doubling on each
+        retry up to max_backoff.
+    """
+    def __init__(self, name, host='localhost', port=6379, max_retries=5,
+                 backoff=1, max_backoff=300, **kwargs):
+        self.key = 'hotqueue:{}'.format(name)
+        self.processing_key = '{}:processing'.format(self.key)
+        self.delayed_key = '{}:delayed'.format(self.key)
+        self.retries_key = '{}:retries'.format(self.key)
+        self.failed_key = '{}:failed'.format(self.key)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.redis = StrictRedis(host=host, port=port, **kwargs)
+
+    def __len__(self):
+        return self.redis.llen(self.key)
+
+    def put(self, *doc_ids):
+        """Add one or more document ids to the queue."""
+        if doc_ids:
+            self.redis.lpush(self.key, *[pickle.dumps(i) for i in doc_ids])
+
+    def reserve(self, limit, timeout=1):
+        """Move up to limit ids from the queue to the processing list and
+        return them. Waits up to timeout seconds for the first id."""
+        msg = self.redis.brpoplpush(self.key, self.processing_key, timeout)
+        if msg is None:
+            return []
+        msgs = [msg]
+        while len(msgs) < limit:
+            msg = self.redis.rpoplpush(self.key, self.processing_key)
+            if msg is None:
+                break
+            msgs.append(msg)
+        return [pickle.loads(i) for i in msgs]
+
+    def ack(self, *doc_ids):
+        """Remove processed ids from the processing list."""
+        pipe = self.redis.pipeline()
+        for msg in [pickle.dumps(i) for i in doc_ids]:
+            pipe.lrem(self.processing_key, 1, msg)
+            pipe.hdel(self.retries_key, msg)
+        pipe.execute()
+
+    def retry(self, doc_id):
+        """Schedule a failed id to be tried again after a backoff. Returns
+        False if it has failed too many times and was moved to the failed
+        list instead."""
+        msg = pickle.dumps(doc_id)
+        attempts = self.redis.hincrby(self.retries_key, msg, 1)
+        pipe = self.redis.pipeline()
+        pipe.lrem(self.processing_key, 1, msg)
+        if attempts > self.max_retries:
+            pipe.hdel(self.retries_key, msg)
+            pipe.lpush(self.failed_key, msg)
+            pipe.execute()
+            return False
+        delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        pipe.zadd(self.delayed_key, time.time() + delay, msg)
+        pipe.execute()
+        return True
+
+    def promote_delayed(self, now=None):
+        """Put ids whose backoff has passed back on the queue. Returns the
+        number of ids moved."""
+        if now is None:
+            now = time.time()
+        msgs = self.redis.zrangebyscore(self.delayed_key, 0, now)
+        if msgs:
+            pipe = self.redis.pipeline()
+            pipe.zrem(self.delayed_key, *msgs)
+            pipe.rpush(self.key, *msgs)
+            pipe.execute()
+        return len(msgs)
+
+    def recover(self):
+        """Put any ids left in the processing list by a process that died back
+        on the queue. Only call this when nothing else is processing."""
+        count = 0
+        while self.redis.rpoplpush(self.processing_key, self.key) is not None:
+            count += 1
+        return count
@@ -1,5 +1,8 @@
 import os
-from app.model.tag import Tag
+from collections import OrderedDict
+from threading import Lock
+from flask import current_app
+from app.model.tag import tag_cache
 # TODO - Add doctrings
 
 
@@ -15,6 +18,40 @@ def ensure_dir(dir):
         os.makedirs(dir)
 
 
+#-----------------------------------------------------------------------------#
+# Caching
+#-----------------------------------------------------------------------------#
+class LRUCache(object):
+    "A thread safe mapping that drops the least recently used keys when full."
+    def __init__(self, size=1024):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
 #-----------------------------------------------------------------------------#
 # Custom Validators
 #-----------------------------------------------------------------------------#
@@ -32,12 +69,43 @@ def string_length(minimum=0, maximum=None):
     return _string_length
 
 
+def configured_length(setting, minimum=0):
+    "Like string_length, with the maximum read from the app's config setting."
+    def _configured_length(value, name):
+        maximum = current_app.config[setting]
+        return string_length(minimum, maximum)(value, name)
+    return _configured_length
+
+
+def field_list(allowed):
+    def _field_list(value, name):
+        if not isinstance(value, unicode):
+            raise ValueError("{} needs to be a string".format(name))
+        fields = [i.strip() for i in value.split(u',') if i.strip()]
+        for field in fields:
+            if field not in allowed:
+                raise ValueError("{} is not a valid field for {}".format(
+                                 field, name))
+        return fields
+    return _field_list
+
+
+def id_list(value, name):
+    if not isinstance(value, list):
+        raise ValueError("{} needs to be a list of ids".format(name))
+    try:
+        return sorted(set(int(i) for i in value))
+    except (TypeError, ValueError):
+        raise ValueError("{} needs to be a list of ids".format(name))
+
+
 def tag_list(value, name):
-    tags = []
-    for i in set(value):
-        tag = Tag.query.get(i)
-        if tag:
-            tags.append(tag)
-        else:
+    try:
+        ids = set(int(i) for i in value)
+    except (TypeError, ValueError):
+        raise ValueError("{} needs to be a list of Tag ids".format(name))
+    tags = tag_cache.get_many(ids)
+    for i in sorted(ids):
+        if i not in tags:
             raise ValueError("{} is not a valid Tag id".format(i))
-    return tags
+    return tags.values()
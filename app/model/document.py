@@ -1,10 +1,77 @@
+import base64
+import os
+import zlib
 from datetime import datetime
 from whoosh import analysis
+from whoosh import columns
 from whoosh.fields import TEXT, DATETIME, KEYWORD, Schema, NUMERIC
 from whoosh import index
+from whoosh.index import LockError
 
 from app import db
 from app import lib
+from app.model.tag import tag_cache
+
+
+#-----------------------------------------------------------------------------#
+# Text Compression
+#-----------------------------------------------------------------------------#
+STORED_TEXT_MODES = ('full', 'zlib', 'snippet')
+# Marks compressed text in the database. Text without it is read as it is,
+# and text that starts with it is always compressed so it reads back intact.
+COMPRESSED_PREFIX = u'\x1fzlib:'
+
+
+def compress_text(text):
+    return zlib.compress(text.encode('utf-8'))
+
+
+def decompress_text(value):
+    return zlib.decompress(value).decode('utf-8')
+
+
+def stored_text(text, mode='full', snippet_length=None):
+    """The text to keep in the index for a document's snippets: all of it,
+    compressed (as a byte string) or only its first snippet_length
+    characters."""
+    if mode not in STORED_TEXT_MODES:
+        raise ValueError("{} is not a stored text mode".format(mode))
+    if text is None or mode == 'full':
+        return text
+    if mode == 'zlib':
+        return compress_text(text)
+    return text[:snippet_length]
+
+
+def index_text(value):
+    """Read text stored in the index by stored_text."""
+    if isinstance(value, str):
+        return decompress_text(value)
+    return value
+
+
+class CompressedText(db.TypeDecorator):
+    """Text that is compressed in the database when DB_COMPRESS_TEXT is set
+    and it is at least DB_COMPRESS_MIN_LENGTH characters long, or when it
+    starts with COMPRESSED_PREFIX. Rows that aren't compressed are read as
+    they are, so the setting can be changed without migrating the table."""
+    impl = db.Text
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        if not value.startswith(COMPRESSED_PREFIX):
+            config = db.get_app().config
+            if not config['DB_COMPRESS_TEXT'] or \
+               len(value) < config['DB_COMPRESS_MIN_LENGTH']:
+                return value
+        return COMPRESSED_PREFIX + base64.b64encode(compress_text(value))
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.startswith(COMPRESSED_PREFIX):
+            return decompress_text(
+                base64.b64decode(value[len(COMPRESSED_PREFIX):]))
+        return value
 
 
 #-----------------------------------------------------------------------------#
@@ -13,7 +80,7 @@ from app import lib
 tags_to_documents = db.Table('tags_to_documents',
     db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
     db.Column('document_id', db.Integer, db.ForeignKey('document.id'),
-              primary_key=True)
+              primary_key=True, index=True)
 )
 
 class Document(db.Model):
@@ -21,9 +88,9 @@ class Document(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(64))
     created = db.Column(db.DateTime())
-    updated = db.Column(db.DateTime())
-    text = db.Column(db.Text())
-    deleted = db.Column(db.Boolean())
+    updated = db.Column(db.DateTime(), index=True)
+    text = db.Column(CompressedText())
+    deleted = db.Column(db.Boolean(), index=True)
     tags = db.relationship('Tag', secondary=tags_to_documents,
                            backref=db.backref('documents', lazy='dynamic'))
 
@@ -40,15 +107,27 @@ class Document(db.Model):
         self.updated = now
         self.title = title
         self.text = text
-        for tag in tags:
-            if type(tag) == int:
-                tag = Tag.query.get(tag_id)
-            self.add_tag(tag)
+        ids = [i for i in tags if isinstance(i, int)]
+        if ids:
+            found = tag_cache.get_many(ids)
+            for i in ids:
+                if i not in found:
+                    raise ValueError("{} is not a valid Tag id".format(i))
+            tags = [found[i] if isinstance(i, int) else i for i in tags]
+        self.add_tags(tags)
 
     def add_tag(self, tag):
         if tag not in self.tags:
             self.tags.append(tag)
 
+    def add_tags(self, tags):
+        """Add each of the tags that the document doesn't already have."""
+        existing = set(self.tags)
+        for tag in tags:
+            if tag not in existing:
+                self.tags.append(tag)
+                existing.add(tag)
+
     def remove_tag(self, tag):
         if tag in self.tags:
             self.tags.remove(tag)
@@ -58,33 +137,189 @@ class Document(db.Model):
         self.deleted = True
 
     def prepare(self):
+        """The fields to index. The text stored for snippets depends on
+        INDEX_STORED_TEXT, the full text is always indexed."""
+        config = db.get_app().config
         prepared_doc = {"id": self.id,
                         "title": self.title,
                         "text": self.text,
                         "created": self.created,
                         "updated": self.updated,
+                        "words": u" ".join([self.title or u"",
+                                            self.text or u""]),
                         }
+        stored = stored_text(self.text, config['INDEX_STORED_TEXT'],
+                             config['INDEX_SNIPPET_LENGTH'])
+        if stored is not self.text:
+            prepared_doc["_stored_text"] = stored
         if len(self.tags):
             prepared_doc["tags"] = [unicode(i.id) for i in self.tags]
         return prepared_doc
 
 
+def purge_deleted(before, chunk_size=1000):
+    """Permanently remove documents that were deleted before the given time,
+    along with their tags, chunk_size documents at a time. Returns the number
+    of documents removed."""
+    purged = 0
+    while True:
+        ids = [i for (i,) in db.session.query(Document.id)
+                                       .filter(Document.deleted == True)
+                                       .filter(Document.updated < before)
+                                       .order_by(Document.id)
+                                       .limit(chunk_size)]
+        if not ids:
+            return purged
+        db.session.execute(tags_to_documents.delete().where(
+            tags_to_documents.c.document_id.in_(ids)))
+        Document.query.filter(Document.id.in_(ids))\
+                      .delete(synchronize_session=False)
+        db.session.commit()
+        purged += len(ids)
+
+
+def _chunks(ids, chunk_size):
+    ids = list(ids)
+    for i in range(0, len(ids), chunk_size):
+        yield ids[i:i + chunk_size]
+
+
+def tag_documents(tag_id, doc_ids, chunk_size=500):
+    """Add the tag to each of the documents that exists, isn't deleted and
+    doesn't already have it, with one select and insert per chunk_size ids.
+    Returns the ids of the documents tagged. The caller commits."""
+    tagged = []
+    for chunk in _chunks(doc_ids, chunk_size):
+        has_tag = db.exists().where(db.and_(
+            tags_to_documents.c.tag_id == tag_id,
+            tags_to_documents.c.document_id == Document.id))
+        ids = [i for (i,) in db.session.query(Document.id)
+                                       .filter(Document.id.in_(chunk))
+                                       .filter(Document.deleted == False)
+                                       .filter(~has_tag)]
+        if ids:
+            db.session.execute(tags_to_documents.insert(),
+                               [{'tag_id': tag_id, 'document_id': i}
+                                for i in ids])
+            tagged.extend(ids)
+    return tagged
+
+
+def untag_documents(tag_id, doc_ids, chunk_size=500):
+    """Remove the tag from each of the documents that has it, with one
+    select and delete per chunk_size ids. Returns the ids of the documents
+    untagged. The caller commits."""
+    untagged = []
+    for chunk in _chunks(doc_ids, chunk_size):
+        has_tag = db.and_(tags_to_documents.c.tag_id == tag_id,
+                          tags_to_documents.c.document_id.in_(chunk))
+        ids = [i for (i,) in db.session.execute(
+            db.select([tags_to_documents.c.document_id]).where(has_tag))]
+        if ids:
+            db.session.execute(tags_to_documents.delete().where(db.and_(
+                tags_to_documents.c.tag_id == tag_id,
+                tags_to_documents.c.document_id.in_(ids))))
+            untagged.extend(ids)
+    return untagged
+
+
 #-----------------------------------------------------------------------------#
 # Search Schema
 #-----------------------------------------------------------------------------#
+class VarBytesColumn(columns.VarBytesColumn):
+    """Whoosh's VarBytesColumn, without the lru_cache on its reader. That
+    cache is shared by every reader in the process and isn't thread safe, so
+    shards sorted or read at the same time raise KeyErrors. The data is
+    written the same way."""
+    class Reader(columns.VarBytesColumn.Reader):
+        def __getitem__(self, docnum):
+            length = self._lengths[docnum]
+            if not length:
+                return columns.emptybytes
+            offset = self._offsets[docnum]
+            return self._dbfile.get(self._basepos + offset, length)
+
+
 analyzer = analysis.NgramWordAnalyzer(3, 10)
-doc_schema = Schema(id=NUMERIC(stored=True, unique=True),
-                    title=TEXT(stored=True),
+# id and title are also kept in columns so search results can be read
+# without loading the stored text
+doc_schema = Schema(id=NUMERIC(stored=True, unique=True, sortable=True),
+                    title=TEXT(stored=True, sortable=VarBytesColumn()),
                     text=TEXT(stored=True, analyzer=analyzer),
                     created=DATETIME(sortable=True),
                     updated=DATETIME(sortable=True),
-                    tags=KEYWORD(scorable=True))
+                    tags=KEYWORD(scorable=True),
+                    # Whole words from the title and text, used to build the
+                    # suggestion dictionary as the text field only has ngrams
+                    words=TEXT(analyzer=analysis.StandardAnalyzer()))
+
+
+def _replaced_columns(ix, schema):
+    """Return the fields whose column is Whoosh's VarBytesColumn in the index
+    and this module's VarBytesColumn in schema. They read the same data so
+    only the schema needs changing."""
+    return [i for i in schema.names()
+            if i in ix.schema and
+            type(ix.schema[i].column_type) is columns.VarBytesColumn and
+            isinstance(schema[i].column_type, VarBytesColumn)]
+
+
+def _upgrade_schema(ix, schema):
+    """Add any fields that are in schema but missing from the index, and
+    swap in the column types that can be changed without a rebuild. If
+    another process is writing to the index it is left for that process to
+    upgrade."""
+    missing = [i for i in schema.names() if i not in ix.schema]
+    replaced = _replaced_columns(ix, schema)
+    if not missing and not replaced:
+        return ix
+    try:
+        writer = ix.writer()
+    except LockError:
+        return ix
+    for name in missing:
+        writer.add_field(name, schema[name])
+    for name in replaced:
+        writer.schema[name].column_type = schema[name].column_type
+    writer.commit()
+    return ix.refresh()
 
 
 def get_index(index_dir, schema=doc_schema):
     lib.ensure_dir(index_dir)
     if index.exists_in(index_dir):
-        ix = index.open_dir(index_dir)
+        ix = _upgrade_schema(index.open_dir(index_dir), schema)
     else:
         ix = index.create_in(index_dir, schema)
     return ix
+
+
+def get_shard_dirs(index_dir, shards=1):
+    """Return the directory for each shard of the index. A single shard lives
+    directly in index_dir so existing indexes keep working."""
+    if shards <= 1:
+        return [index_dir]
+    return [os.path.join(index_dir, 'shard-{}'.format(i))
+            for i in range(shards)]
+
+
+def get_indexes(index_dir, shards=1, schema=doc_schema):
+    """Return a list of the indexes for each shard, in shard order."""
+    return [get_index(i, schema) for i in get_shard_dirs(index_dir, shards)]
+
+
+def index_size(ix):
+    """Return the number of bytes the index's files take up on disk."""
+    size = 0
+    for name in ix.storage.list():
+        try:
+            size += ix.storage.file_length(name)
+        except OSError:
+            # Removed by a merge since the files were listed
+            pass
+    return size
+
+
+def shard_for(doc_id, shards=1):
+    """Return the number of the shard that the document should be stored in."""
+    return int(doc_id) % max(shards, 1)
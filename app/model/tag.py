@@ -1,3 +1,7 @@
+from threading import Lock
+
+from sqlalchemy.orm.util import identity_key
+
 from app import db
 
 
@@ -15,3 +19,62 @@ class Tag(db.Model):
     def update(self, title, description=None):
         self.title = title
         self.description = description
+
+
+#-----------------------------------------------------------------------------#
+# Cache
+#-----------------------------------------------------------------------------#
+class TagCache(object):
+    """An in-process cache of tags so that the tags in a request can be looked
+    up without querying for each one.
+
+    Detached copies of the tags are kept and merged in to the session they are
+    asked for from, which doesn't hit the database. Anything that changes a
+    tag should invalidate it.
+    """
+    def __init__(self):
+        self._tags = {}
+        self._lock = Lock()
+
+    def get_many(self, ids, session=None):
+        """Return a dict of id to :class:`Tag` for each of the ids that exists.
+        Tags that aren't cached are loaded with a single query."""
+        if session is None:
+            session = db.session()
+        ids = set(ids)
+        found = {}
+        with self._lock:
+            cached = dict((i, self._tags[i]) for i in ids if i in self._tags)
+        for i in ids:
+            # Tags the session already has may have changes of their own
+            tag = session.identity_map.get(identity_key(Tag, i))
+            if tag is not None:
+                found[i] = tag
+            elif i in cached:
+                found[i] = session.merge(cached[i], load=False)
+
+        missing = ids - set(found)
+        if missing:
+            loaded = Tag.query.filter(Tag.id.in_(missing)).all()
+            for tag in loaded:
+                session.expunge(tag)
+            with self._lock:
+                self._tags.update((tag.id, tag) for tag in loaded)
+            for tag in loaded:
+                found[tag.id] = session.merge(tag, load=False)
+        return found
+
+    def invalidate(self, *ids):
+        with self._lock:
+            for i in ids:
+                self._tags.pop(i, None)
+
+    def clear(self):
+        with self._lock:
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._tags)
+
+
+tag_cache = TagCache()
@@ -0,0 +1,119 @@
+"""
+    Searchr Profiling
+    -----------------
+
+    Opt-in cProfile capture for selected requests (and index deamon batches)
+    and a structured log of slow searches.
+"""
+import cProfile
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+from app import lib
+
+
+slow_query_log = logging.getLogger('searchr.slow_queries')
+
+
+#-----------------------------------------------------------------------------#
+# cProfile
+#-----------------------------------------------------------------------------#
+def sampled(rate):
+    """Return True for roughly rate (0 to 1) of the calls."""
+    return rate > 0 and random.random() < rate
+
+
+class Profile(object):
+    """Profile everything between start and stop and write the stats to
+    <profile_dir>/<name>-<start time in ms>-<pid>.prof.
+
+    The stats can be read with pstats or a viewer like snakeviz."""
+    def __init__(self, name, profile_dir):
+        self.name = name
+        self.profile_dir = profile_dir
+        self.profiler = cProfile.Profile()
+        self.started = None
+
+    def start(self):
+        self.started = time.time()
+        self.profiler.enable()
+
+    def stop(self):
+        """Stop profiling and return the path the stats were written to."""
+        self.profiler.disable()
+        lib.ensure_dir(self.profile_dir)
+        path = os.path.join(self.profile_dir, '{}-{}-{}.prof'.format(
+                            self.name, int(self.started * 1000), os.getpid()))
+        self.profiler.dump_stats(path)
+        return path
+
+
+#-----------------------------------------------------------------------------#
+# Slow Query Log
+#-----------------------------------------------------------------------------#
+class PhaseTimer(object):
+    """Records how long each named phase of a request takes, in ms."""
+    def __init__(self):
+        self.timings = {}
+        self.started = time.time()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[name] = (time.time() - start) * 1000
+
+    @property
+    def total(self):
+        return (time.time() - self.started) * 1000
+
+
+def log_slow_query(threshold, timer, **details):
+    """Write details and the timings to the slow query log, as a line of JSON,
+    if the request took at least threshold ms."""
+    total = timer.total
+    if total < threshold:
+        return
+    details['timings'] = timer.timings
+    details['total'] = total
+    slow_query_log.warning(json.dumps(details, sort_keys=True))
+
+
+#-----------------------------------------------------------------------------#
+# Setup
+#-----------------------------------------------------------------------------#
+def init_profiling(app):
+    """Set up the slow query log and the hooks that profile requests to
+    PROFILE_ENDPOINTS. A request is profiled if PROFILE_ENABLED is set and
+    it either has the PROFILE_HEADER header or is picked by
+    PROFILE_SAMPLE_RATE."""
+    if app.config['SLOW_QUERY_LOG']:
+        handler = logging.FileHandler(app.config['SLOW_QUERY_LOG'])
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        slow_query_log.addHandler(handler)
+        slow_query_log.setLevel(logging.INFO)
+
+    @app.before_request
+    def _start_profile():
+        if not app.config['PROFILE_ENABLED'] or \
+           request.endpoint not in app.config['PROFILE_ENDPOINTS']:
+            return
+        if request.headers.get(app.config['PROFILE_HEADER']) or \
+           sampled(app.config['PROFILE_SAMPLE_RATE']):
+            g.profile = Profile(request.endpoint, app.config['PROFILE_DIR'])
+            g.profile.start()
+
+    @app.teardown_request
+    def _stop_profile(exc):
+        profile = getattr(g, 'profile', None)
+        if profile is not None:
+            profile.stop()
+            g.profile = None
@@ -0,0 +1,145 @@
+"""
+    Searchr Reconcile
+    -----------------
+
+    Finds the documents that need to be reindexed by comparing the database
+    with the index, so a repair only queues the documents that are new,
+    changed, deleted or missing instead of every document.
+"""
+import heapq
+import json
+import os
+
+from whoosh.util.times import datetime_to_long, long_to_datetime
+
+from app import db
+from app.model.document import Document
+
+
+HIGH_WATER_MARK = 'high_water_mark.json'
+
+
+#-----------------------------------------------------------------------------#
+# High Water Mark
+#-----------------------------------------------------------------------------#
+def read_high_water_mark(index_dir):
+    """Return the newest updated time that has been committed to the index,
+    or None if it has not been recorded."""
+    try:
+        with open(os.path.join(index_dir, HIGH_WATER_MARK)) as f:
+            return long_to_datetime(json.load(f)['updated'])
+    except IOError:
+        return None
+
+
+def write_high_water_mark(index_dir, updated):
+    """Record updated as the high water mark if it is newer than the current
+    one."""
+    current = read_high_water_mark(index_dir)
+    if current is not None and current >= updated:
+        return
+    path = os.path.join(index_dir, HIGH_WATER_MARK)
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        json.dump({'updated': datetime_to_long(updated)}, f)
+    os.rename(tmp_path, path)
+
+
+#-----------------------------------------------------------------------------#
+# Streams
+#-----------------------------------------------------------------------------#
+def _index_entries(reader):
+    """Yield an (id, updated) tuple for every document in the reader, in id
+    order. Walks the id lexicon so the stored fields are never loaded."""
+    field = reader.schema['id']
+    if reader.has_column('updated'):
+        updated = reader.column_reader('updated')
+    else:
+        updated = None
+    for token in field.sortable_terms(reader, 'id'):
+        postings = reader.postings('id', token)
+        if postings.is_active():
+            docnum = postings.id()
+            yield (field.from_bytes(token),
+                   updated[docnum] if updated is not None else None)
+
+
+def _db_entries(query, batch_size=1000):
+    """Yield the rows of the (id, updated, deleted) query in id order, fetching
+    batch_size rows at a time."""
+    last_id = 0
+    while True:
+        rows = query.filter(Document.id > last_id)\
+                    .order_by(Document.id)\
+                    .limit(batch_size)\
+                    .all()
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1].id
+
+
+def _db_query():
+    return db.session.query(Document.id, Document.updated, Document.deleted)
+
+
+#-----------------------------------------------------------------------------#
+# Reconcile
+#-----------------------------------------------------------------------------#
+def _same_time(a, b):
+    if a is None or b is None:
+        return a is b
+    return datetime_to_long(a) == datetime_to_long(b)
+
+
+def reconcile(indexes, high_water_mark=None, batch_size=1000):
+    """Yield a (doc_id, reason) tuple for each document that needs to be
+    reindexed. The reason is one of:
+
+    new
+        In the database but not the index, and updated after the high water
+        mark.
+    missing
+        In the database but not the index, and should already have been
+        indexed.
+    changed
+        In both, but the updated times do not match.
+    deleted
+        Deleted (or removed) from the database but still in the index.
+
+    The database and the index shards are both read in id order, so only a
+    batch of rows is ever held in memory.
+    """
+    readers = [ix.reader() for ix in indexes]
+    try:
+        indexed = heapq.merge(*[_index_entries(r) for r in readers])
+        index_entry = next(indexed, None)
+        for row in _db_entries(_db_query(), batch_size):
+            while index_entry is not None and index_entry[0] < row.id:
+                yield index_entry[0], 'deleted'
+                index_entry = next(indexed, None)
+
+            in_index = index_entry is not None and index_entry[0] == row.id
+            if row.deleted:
+                if in_index:
+                    yield row.id, 'deleted'
+            elif not in_index:
+                if high_water_mark is None or row.updated is None or \
+                   row.updated > high_water_mark:
+                    yield row.id, 'new'
+                else:
+                    yield row.id, 'missing'
+            elif not _same_time(row.updated, index_entry[1]):
+                yield row.id, 'changed'
+
+            if in_index:
+                index_entry = next(indexed, None)
+
+        while index_entry is not None:
+            yield index_entry[0], 'deleted'
+            index_entry = next(indexed, None)
+    finally:
+        for reader in readers:
+            reader.close()
+
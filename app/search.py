@@ -0,0 +1,374 @@
+"""
+    Searchr Search
+    --------------
+
+    Parses queries and runs them across all of the index shards at once,
+    merging the results so they look like they came from a single index.
+"""
+from itertools import chain
+from math import ceil
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+from whoosh import scoring
+from whoosh.fields import NUMERIC, DATETIME
+from whoosh.query import Term
+
+
+class QueryError(ValueError):
+    """Raised when a query string can not be parsed."""
+
+
+class SortError(ValueError):
+    """Raised when results can not be sorted by the given field."""
+
+
+#-----------------------------------------------------------------------------#
+# Query Parsing
+#-----------------------------------------------------------------------------#
+_parsers = {}
+_parsers_lock = Lock()
+
+
+def _fields_key(default_field):
+    """A hashable version of default_field, which is either a field name or a
+    dict of field names to boosts."""
+    if isinstance(default_field, dict):
+        return tuple(sorted(default_field.items()))
+    return default_field
+
+
+def get_parser(schema, default_field):
+    """Return a shared parser for the schema and default field. If
+    default_field is a dict of field names to boosts, terms that don't name a
+    field search all of those fields.
+
+    Building the date parser plugin is slow so parsers are only built once,
+    and the parser modules are only imported when the first one is needed."""
+    key = (tuple(schema.names()), _fields_key(default_field))
+    with _parsers_lock:
+        if key not in _parsers:
+            from whoosh import qparser
+            from whoosh.qparser.dateparse import DateParserPlugin
+            if isinstance(default_field, dict):
+                qp = qparser.MultifieldParser(sorted(default_field), schema,
+                                              fieldboosts=default_field)
+            else:
+                qp = qparser.QueryParser(default_field, schema)
+            qp.add_plugin(DateParserPlugin())
+            qp.add_plugin(qparser.GtLtPlugin())
+            _parsers[key] = qp
+        return _parsers[key]
+
+
+def _errors(query):
+    """Yield the error messages the parser attached to the query tree."""
+    if getattr(query, 'error', None):
+        yield query.error
+    for child in query.children():
+        for error in _errors(child):
+            yield error
+
+
+def _render(query, schema):
+    """Return the query as a unicode string. Terms for NUMERIC fields are
+    stored as encoded bytes which can't be turned in to unicode, so they are
+    decoded first."""
+    def _decode(q):
+        if isinstance(q, Term) and isinstance(q.text, bytes) and \
+           isinstance(schema[q.fieldname], NUMERIC):
+            return Term(q.fieldname, schema[q.fieldname].from_bytes(q.text),
+                        boost=q.boost)
+        return q
+    return unicode(query.accept(_decode))
+
+
+def _is_cacheable(query, schema):
+    """Dates can be relative to now (e.g. created:yesterday or created:now)
+    so queries on DATETIME fields can't be reused."""
+    fieldname = getattr(query, 'fieldname', None)
+    if fieldname in schema and isinstance(schema[fieldname], DATETIME):
+        return False
+    return all(_is_cacheable(i, schema) for i in query.children())
+
+
+def parse_query(querystring, schema, default_field, cache=None):
+    """Parse the query string, returning a (query, unicode string) tuple.
+
+    Raises :class:`QueryError` if the query string is not valid. If an
+    :class:`~app.lib.LRUCache` is given parsed queries are kept in it.
+    """
+    key = (querystring, _fields_key(default_field), tuple(schema.names()))
+    if cache is not None:
+        parsed = cache.get(key)
+        if parsed is not None:
+            return parsed
+
+    try:
+        query = get_parser(schema, default_field).parse(querystring)
+    except Exception as e:
+        raise QueryError(u"Could not parse query: {}".format(e))
+    for error in _errors(query):
+        raise QueryError(u"Could not parse query: {}".format(error))
+
+    parsed = (query, _render(query, schema))
+    if cache is not None and _is_cacheable(query, schema):
+        cache.set(key, parsed)
+    return parsed
+
+
+#-----------------------------------------------------------------------------#
+# Weighting
+#-----------------------------------------------------------------------------#
+WEIGHTINGS = {'bm25f': scoring.BM25F,
+              'tf_idf': scoring.TF_IDF,
+              'frequency': scoring.Frequency,
+              'pl2': scoring.PL2}
+
+
+def get_weighting(name, options=None):
+    """Return the named weighting model. options are passed to the model,
+    e.g. {'B': 0.75, 'K1': 1.2} for bm25f. Field length norms are written to
+    the index when documents are added, so any model can be used without
+    reindexing."""
+    if name not in WEIGHTINGS:
+        raise ValueError("{} is not a weighting model".format(name))
+    return WEIGHTINGS[name](**(options or {}))
+
+
+class GlobalStats(object):
+    """The term statistics of all of the shards added together.
+
+    Whoosh's scorers read IDF, term frequencies and average field lengths
+    from the searcher's parent, so this is given to them as the parent and
+    every shard scores its hits as a single index of all the documents
+    would."""
+    def __init__(self, searchers, weighting):
+        self.searchers = searchers
+        self.weighting = weighting
+        self._idf = {}
+
+    def get_parent(self):
+        return self
+
+    def doc_count_all(self):
+        return sum(s.doc_count_all() for s in self.searchers)
+
+    def doc_frequency(self, fieldname, text):
+        return sum(s.doc_frequency(fieldname, text) for s in self.searchers)
+
+    def frequency(self, fieldname, text):
+        return sum(s.frequency(fieldname, text) for s in self.searchers)
+
+    def field_length(self, fieldname):
+        return sum(s.field_length(fieldname) for s in self.searchers)
+
+    def avg_field_length(self, fieldname, default=None):
+        if not self.searchers[0].schema[fieldname].scorable:
+            return default
+        return self.field_length(fieldname) / float(self.doc_count_all() or 1)
+
+    def idf(self, fieldname, text):
+        key = (fieldname, text)
+        if key not in self._idf:
+            self._idf[key] = self.weighting.idf(self, fieldname, text)
+        return self._idf[key]
+
+
+class _ScoringSearcher(object):
+    """A shard's searcher, with GlobalStats as its parent."""
+    def __init__(self, searcher, stats):
+        self._searcher = searcher
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._searcher, name)
+
+    def get_parent(self):
+        return self._stats
+
+
+class GlobalWeighting(scoring.WeightingModel):
+    """Scores with weighting, using the statistics of all of the shards."""
+    def __init__(self, weighting):
+        self.weighting = weighting
+        self.use_final = weighting.use_final
+        self.stats = None
+
+    def idf(self, searcher, fieldname, text):
+        return self.stats.idf(fieldname, text)
+
+    def scorer(self, searcher, fieldname, text, qf=1):
+        return self.weighting.scorer(_ScoringSearcher(searcher, self.stats),
+                                     fieldname, text, qf=qf)
+
+    def final(self, searcher, docnum, score):
+        return self.weighting.final(searcher, docnum, score)
+
+
+#-----------------------------------------------------------------------------#
+# Thread Pool
+#-----------------------------------------------------------------------------#
+_pool = None
+_pool_lock = Lock()
+
+
+def get_pool(size):
+    """Return a shared thread pool, created with size threads on the first
+    call. It is never replaced as other requests may be using it, so if more
+    shards are added later some are searched one after the other."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(size)
+        return _pool
+
+
+#-----------------------------------------------------------------------------#
+# Results
+#-----------------------------------------------------------------------------#
+def _merge(shard_results, descending):
+    """Merge the top hits from each shard in to one ordered list of
+    (key, shard, position) tuples.
+
+    The hits are added in position then shard order before a stable sort so
+    that ties are broken the same way on every request.
+    """
+    items = []
+    longest = max([len(i.top_n) for i in shard_results] or [0])
+    for pos in range(longest):
+        for shard, results in enumerate(shard_results):
+            if pos < len(results.top_n):
+                items.append((results.top_n[pos][0], shard, pos))
+    items.sort(key=lambda i: i[0], reverse=descending)
+    return items
+
+
+class ShardedResultsPage(object):
+    """A page of results merged from several shards.
+
+    Behaves like :class:`whoosh.searching.ResultsPage` so the hits can be
+    processed the same way, with each hit's rank set to its position in the
+    merged results.
+    """
+    def __init__(self, shard_results, pagenum, pagelen=10, sortedby=None,
+                 reverse=False):
+        self.shard_results = shard_results
+        self.total = sum(len(i) for i in shard_results)
+        # Scored results are best first, sorted results are smallest first.
+        descending = (sortedby is None) != bool(reverse)
+        self.items = _merge(shard_results, descending)
+
+        self.pagecount = int(ceil(self.total / float(pagelen)))
+        self.pagenum = min(self.pagecount, pagenum)
+
+        offset = max(self.pagenum - 1, 0) * pagelen
+        if (offset + pagelen) > self.total:
+            pagelen = self.total - offset
+        self.offset = offset
+        self.pagelen = pagelen
+
+    def __iter__(self):
+        for rank in range(self.offset, self.offset + self.pagelen):
+            _, shard, pos = self.items[rank]
+            hit = self.shard_results[shard][pos]
+            hit.rank = hit.pos = rank
+            yield hit
+
+    def __len__(self):
+        return self.total
+
+
+#-----------------------------------------------------------------------------#
+# Searcher
+#-----------------------------------------------------------------------------#
+class ShardSearcher(object):
+    """Search over a list of indexes at the same time.
+
+    Should be used as a context manager so that the searcher for each shard is
+    closed once the results have been processed::
+
+        with ShardSearcher(indexes) as searcher:
+            results = searcher.search_page(query, 1, pagelen=25)
+
+    When there is more than one shard the hits are scored with the term
+    statistics of all of the shards, so scores and ranks are the same as
+    they would be in one index. If a weighting model is given it is used
+    instead of the default BM25F.
+    """
+    def __init__(self, indexes, weighting=None):
+        self.indexes = indexes
+        self.weighting = weighting
+        self.searchers = []
+
+    def __enter__(self):
+        weighting = self.weighting or scoring.BM25F()
+        if len(self.indexes) > 1:
+            weighting = GlobalWeighting(weighting)
+        self.searchers = [ix.searcher(weighting=weighting)
+                          for ix in self.indexes]
+        if len(self.indexes) > 1:
+            weighting.stats = GlobalStats(self.searchers, weighting.weighting)
+        return self
+
+    def __exit__(self, *exc_info):
+        for searcher in self.searchers:
+            searcher.close()
+        self.searchers = []
+
+    def _map(self, func):
+        """Call func with each shard's searcher, concurrently if there is more
+        than one shard."""
+        if len(self.searchers) == 1:
+            return [func(self.searchers[0])]
+        return get_pool(len(self.searchers)).map(func, self.searchers)
+
+    def _check_sortable(self, sortedby):
+        """Raise :class:`SortError` if sortedby isn't a field, or if there is
+        more than one shard and it doesn't have a column in all of them.
+        Without a column each shard sorts by term ordinals that mean nothing
+        in the other shards, so the hits can't be merged. Fields in indexes
+        built before they had columns need a rebuild to be sorted on."""
+        if not isinstance(sortedby, basestring):
+            return
+        for searcher in self.searchers:
+            if sortedby not in searcher.schema:
+                raise SortError(u"{} is not a field".format(sortedby))
+            reader = searcher.reader()
+            # Empty shards have no hits to merge
+            if len(self.searchers) > 1 and reader.doc_count_all() and \
+               not reader.has_column(sortedby):
+                raise SortError(u"Can not sort by {} over more than one "
+                                u"shard".format(sortedby))
+
+    def search_page(self, query, pagenum, pagelen=10, sortedby=None,
+                    reverse=False, **kwargs):
+        """Return a :class:`ShardedResultsPage` for the given page of the
+        merged results. Any extra kwargs are passed to each shard's search."""
+        if pagenum < 1:
+            raise ValueError("pagenum must be >= 1")
+        self._check_sortable(sortedby)
+        limit = pagenum * pagelen
+
+        def _search(searcher):
+            return searcher.search(query, limit=limit, sortedby=sortedby,
+                                   reverse=reverse, **kwargs)
+
+        shard_results = self._map(_search)
+        return ShardedResultsPage(shard_results, pagenum, pagelen, sortedby,
+                                  reverse)
+
+    def matching_values(self, query, fieldname=u'id'):
+        """Return the value of fieldname for every document in every shard
+        that matches the query, read from the field's column if it has
+        one."""
+        def _values(searcher):
+            results = searcher.search(query, limit=None, scored=False)
+            reader = searcher.reader()
+            if reader.has_column(fieldname):
+                column = reader.column_reader(fieldname)
+                return [column[docnum] for docnum in results.docs()]
+            return [searcher.stored_fields(docnum)[fieldname]
+                    for docnum in results.docs()]
+
+        return list(chain(*self._map(_values)))
@@ -0,0 +1,228 @@
+"""
+    Searchr Snapshots
+    -----------------
+
+    Lets search nodes serve from a copy of the index instead of the directory
+    the index deamon writes to.
+
+    The index deamon publishes immutable generations of the index, each one a
+    versioned directory plus a manifest that points to the newest generation.
+    Search nodes sync the newest generation to a local directory and swap to
+    it without closing the indexes that in-flight queries are still using.
+"""
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from threading import Lock
+
+from whoosh import index
+
+from app import lib
+from app.model.document import get_shard_dirs
+
+
+MANIFEST = 'manifest.json'
+
+
+#-----------------------------------------------------------------------------#
+# Manifests
+#-----------------------------------------------------------------------------#
+def _generation_dir(generation):
+    return 'gen-{:08d}'.format(generation)
+
+
+def read_manifest(base_dir):
+    """Return the manifest in base_dir or None if nothing has been published
+    there yet."""
+    try:
+        with open(os.path.join(base_dir, MANIFEST)) as f:
+            return json.load(f)
+    except IOError:
+        return None
+
+
+def write_manifest(base_dir, manifest):
+    """Write the manifest to base_dir. The manifest is written to a temporary
+    file and then renamed over the old one so readers never see a partial
+    manifest."""
+    path = os.path.join(base_dir, MANIFEST)
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.rename(tmp_path, path)
+
+
+def _prune(base_dir, generation, keep):
+    """Remove all but the newest keep generations older than generation."""
+    for name in os.listdir(base_dir):
+        if not name.startswith('gen-') or name.endswith('.tmp'):
+            continue
+        try:
+            old = int(name[4:])
+        except ValueError:
+            continue
+        if old <= generation - keep:
+            shutil.rmtree(os.path.join(base_dir, name), ignore_errors=True)
+
+
+def _same_file(a, b):
+    a, b = os.stat(a), os.stat(b)
+    return a.st_size == b.st_size and int(a.st_mtime) == int(b.st_mtime)
+
+
+def _copy_tree(src, dst, previous=None):
+    """Copy the index files in src to dst. Whoosh never changes a file once
+    it has been written, so files that are already in the previous
+    generation's copy, with the same size and modified time, are hard linked
+    from there instead of being copied again."""
+    os.makedirs(dst)
+    for name in os.listdir(src):
+        if 'LOCK' in name:
+            continue
+        path = os.path.join(src, name)
+        old = os.path.join(previous, name) if previous else None
+        if os.path.isdir(path):
+            _copy_tree(path, os.path.join(dst, name), old)
+            continue
+        if old and os.path.isfile(old) and _same_file(path, old):
+            try:
+                os.link(old, os.path.join(dst, name))
+                continue
+            except OSError:
+                # e.g. the filesystem doesn't support hard links
+                pass
+        shutil.copy2(path, os.path.join(dst, name))
+
+
+def _copy_generation(src, base_dir, name, previous=None):
+    """Copy src to base_dir/name via a temporary directory so that a
+    generation directory is either complete or missing. Unchanged files are
+    linked from base_dir/previous."""
+    tmp_dir = os.path.join(base_dir, '{}.tmp'.format(name))
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    _copy_tree(src, tmp_dir, previous and os.path.join(base_dir, previous))
+    os.rename(tmp_dir, os.path.join(base_dir, name))
+
+
+#-----------------------------------------------------------------------------#
+# Publishing
+#-----------------------------------------------------------------------------#
+def publish(index_dir, shards, publish_dir, keep=3):
+    """Publish a copy of the committed index as a new generation in
+    publish_dir and return the new generation number. Only the files written
+    since the last generation are copied.
+
+    Nothing should be writing to the index while it is being copied.
+    """
+    lib.ensure_dir(publish_dir)
+    manifest = read_manifest(publish_dir) or {'generation': 0}
+    generation = manifest['generation'] + 1
+    name = _generation_dir(generation)
+    src_dirs = get_shard_dirs(index_dir, shards)
+    # Unchanged files are linked from the last generation
+    if manifest.get('shards') == shards:
+        old_dirs = get_shard_dirs(os.path.join(publish_dir, manifest['path']),
+                                  shards)
+    else:
+        old_dirs = [None] * len(src_dirs)
+
+    tmp_dir = os.path.join(publish_dir, '{}.tmp'.format(name))
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for src, dst, old in zip(src_dirs, get_shard_dirs(tmp_dir, shards),
+                             old_dirs):
+        _copy_tree(src, dst, old)
+    os.rename(tmp_dir, os.path.join(publish_dir, name))
+
+    write_manifest(publish_dir, {'generation': generation,
+                                 'path': name,
+                                 'shards': shards,
+                                 'published': datetime.utcnow().isoformat()})
+    _prune(publish_dir, generation, keep)
+    return generation
+
+
+def sync(publish_dir, replica_dir, keep=3):
+    """Copy the newest published generation to replica_dir if it is not
+    already there. Returns the generation the replica is now on, or None if
+    nothing has been published yet."""
+    published = read_manifest(publish_dir)
+    if published is None:
+        return None
+    lib.ensure_dir(replica_dir)
+    current = read_manifest(replica_dir)
+    if current is not None and \
+       current['generation'] >= published['generation']:
+        return current['generation']
+
+    if not os.path.exists(os.path.join(replica_dir, published['path'])):
+        _copy_generation(os.path.join(publish_dir, published['path']),
+                         replica_dir, published['path'],
+                         current['path'] if current else None)
+    write_manifest(replica_dir, published)
+    _prune(replica_dir, published['generation'], keep)
+    return published['generation']
+
+
+#-----------------------------------------------------------------------------#
+# Serving
+#-----------------------------------------------------------------------------#
+def open_generation(gen_dir, shards):
+    """Open the indexes of a synced generation without writing to them.
+    Raises IOError if any of its shards is missing."""
+    indexes = []
+    for shard_dir in get_shard_dirs(gen_dir, shards):
+        if not index.exists_in(shard_dir):
+            raise IOError("No index in {}".format(shard_dir))
+        indexes.append(index.open_dir(shard_dir))
+    return indexes
+
+
+class Replica(object):
+    """The indexes for the newest generation synced to a replica directory.
+
+    The manifest is checked at most once every check_interval seconds and the
+    indexes for a new generation are swapped in under a lock. Queries that
+    are already running keep the indexes they started with, and the old
+    generation stays on disk until it has been pruned by a later sync.
+    """
+    def __init__(self, replica_dir, check_interval=1):
+        self.replica_dir = replica_dir
+        self.check_interval = check_interval
+        self.generation = None
+        self._indexes = None
+        self._checked = 0
+        self._lock = Lock()
+
+    def _refresh(self):
+        manifest = read_manifest(self.replica_dir)
+        if manifest is None:
+            raise IOError("No index has been synced to {}".format(
+                          self.replica_dir))
+        if manifest['generation'] != self.generation:
+            gen_dir = os.path.join(self.replica_dir, manifest['path'])
+            self._indexes = open_generation(gen_dir, manifest['shards'])
+            self.generation = manifest['generation']
+
+    def indexes(self):
+        """Return the list of shard indexes for the current generation."""
+        now = time.time()
+        with self._lock:
+            if self._indexes is None or \
+               now - self._checked >= self.check_interval:
+                self._refresh()
+                self._checked = now
+            return self._indexes
+
+
+_replicas = {}
+_replicas_lock = Lock()
+
+
+def get_replica(replica_dir, check_interval=1):
+    """Return the shared :class:`Replica` for replica_dir."""
+    with _replicas_lock:
+        if replica_dir not in _replicas:
+            _replicas[replica_dir] = Replica(replica_dir, check_interval)
+        return _replicas[replica_dir]
@@ -0,0 +1,214 @@
+"""
+    Searchr Suggest
+    ---------------
+
+    Prefix completion and "did you mean" corrections served from an in-memory
+    dictionary of the terms in the index, so suggestions never have to read
+    posting lists.
+"""
+import heapq
+import logging
+import time
+from array import array
+from bisect import bisect_left
+from threading import Lock, Thread
+
+
+SUGGEST_FIELDS = ('title', 'words')
+
+log = logging.getLogger('searchr.suggest')
+
+
+#-----------------------------------------------------------------------------#
+# Term Dictionary
+#-----------------------------------------------------------------------------#
+class TermDictionary(object):
+    """A sorted list of terms with a parallel array of document frequencies.
+
+    The best completions for the short prefixes, where a prefix can match a
+    large part of the dictionary, are worked out when the dictionary is built.
+    Longer prefixes only match a small range of the sorted terms so those are
+    ranked when they are asked for.
+    """
+    def __init__(self, doc_freqs, limit=10, precomputed_length=2):
+        self.terms = sorted(doc_freqs)
+        self.doc_freqs = array('L', [doc_freqs[i] for i in self.terms])
+        self.lookup = dict((term, i) for i, term in enumerate(self.terms))
+        self.limit = limit
+        self.precomputed_length = precomputed_length
+        self.alphabet = u''.join(sorted(set(u''.join(self.terms))))
+        self.prefixes = self._precompute()
+
+    @classmethod
+    def from_indexes(cls, indexes, fieldnames=SUGGEST_FIELDS, **kwargs):
+        """Build a dictionary from the lexicons of the given fields in each of
+        the indexes, adding the document frequencies across shards."""
+        doc_freqs = {}
+        for ix in indexes:
+            with ix.reader() as reader:
+                shard_freqs = {}
+                for fieldname in fieldnames:
+                    if fieldname not in reader.schema:
+                        continue
+                    from_bytes = reader.schema[fieldname].from_bytes
+                    for btext, info in reader.iter_field(fieldname):
+                        term = from_bytes(btext)
+                        shard_freqs[term] = max(shard_freqs.get(term, 0),
+                                                info.doc_frequency())
+                for term, freq in shard_freqs.iteritems():
+                    doc_freqs[term] = doc_freqs.get(term, 0) + freq
+        return cls(doc_freqs, **kwargs)
+
+    def _precompute(self):
+        prefixes = {}
+        for i, term in enumerate(self.terms):
+            for length in range(1, self.precomputed_length + 1):
+                if len(term) < length:
+                    break
+                heap = prefixes.setdefault(term[:length], [])
+                item = (self.doc_freqs[i], -i)
+                if len(heap) < self.limit:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+        return dict((prefix, [-i for _, i in sorted(heap, reverse=True)])
+                    for prefix, heap in prefixes.iteritems())
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.lookup
+
+    def doc_freq(self, term):
+        i = self.lookup.get(term)
+        return self.doc_freqs[i] if i is not None else 0
+
+    def complete(self, prefix, limit=None):
+        """Return up to limit (term, doc_freq) tuples that start with prefix,
+        most frequent first."""
+        limit = limit or self.limit
+        if len(prefix) <= self.precomputed_length and limit <= self.limit:
+            best = self.prefixes.get(prefix, [])[:limit]
+        else:
+            start = bisect_left(self.terms, prefix)
+            stop = bisect_left(self.terms, prefix + u'\uffff', start)
+            best = heapq.nlargest(limit, xrange(start, stop),
+                                  key=lambda i: (self.doc_freqs[i], -i))
+        return [(self.terms[i], self.doc_freqs[i]) for i in best]
+
+    def _edits(self, word):
+        """All the strings one delete, transpose, replace or insert away from
+        word."""
+        splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+        for a, b in splits:
+            if b:
+                yield a + b[1:]
+            if len(b) > 1:
+                yield a + b[1] + b[0] + b[2:]
+            for c in self.alphabet:
+                if b:
+                    yield a + c + b[1:]
+                yield a + c + b
+
+    def correct(self, word, limit=None):
+        """Return up to limit (term, doc_freq) tuples for the terms one edit
+        away from word, most frequent first."""
+        limit = limit or self.limit
+        found = set(i for i in self._edits(word) if i in self.lookup)
+        found.discard(word)
+        best = heapq.nlargest(limit, found, key=self.doc_freq)
+        return [(i, self.doc_freq(i)) for i in best]
+
+    def did_you_mean(self, words):
+        """Replace each word that isn't in the dictionary with its best
+        correction. Returns None if there is nothing to correct."""
+        corrected = []
+        for word in words:
+            if word not in self.lookup:
+                corrections = self.correct(word, 1)
+                if corrections:
+                    word = corrections[0][0]
+            corrected.append(word)
+        if corrected == list(words):
+            return None
+        return u' '.join(corrected)
+
+
+#-----------------------------------------------------------------------------#
+# Cache
+#-----------------------------------------------------------------------------#
+def index_generation(indexes):
+    """Return a key that changes whenever any of the indexes is committed
+    to."""
+    return tuple((ix.storage.folder, ix.latest_generation()) for ix in indexes)
+
+
+class DictionaryCache(object):
+    """Keeps the term dictionary for the indexes being searched.
+
+    Only the first dictionary is built when it is asked for. After that, when
+    the indexes have been committed to, or replaced by a new generation on a
+    replica, the current dictionary is still returned while a new one is
+    built in a background thread, at most once every min_interval seconds, so
+    requests never wait for a rebuild.
+    """
+    def __init__(self):
+        self.dictionary = None
+        self.generation = None
+        self.built = 0
+        self.thread = None
+        self.lock = Lock()
+
+    def get(self, indexes, min_interval=0):
+        generation = index_generation(indexes)
+        with self.lock:
+            if self.dictionary is None:
+                self.dictionary = TermDictionary.from_indexes(indexes)
+                self.generation = generation
+                self.built = time.time()
+            elif generation != self.generation and not self.building and \
+                 time.time() - self.built >= min_interval:
+                self.thread = Thread(target=self._rebuild,
+                                     args=(indexes, generation))
+                self.thread.daemon = True
+                self.thread.start()
+            return self.dictionary
+
+    @property
+    def building(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _rebuild(self, indexes, generation):
+        try:
+            dictionary = TermDictionary.from_indexes(indexes)
+        except Exception:
+            log.exception("Rebuilding the suggestion dictionary failed")
+            dictionary = None
+        with self.lock:
+            self.built = time.time()
+            if dictionary is not None:
+                self.dictionary = dictionary
+                self.generation = generation
+
+    def wait(self, timeout=None):
+        """Wait for a rebuild in progress to finish."""
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def clear(self):
+        self.wait()
+        with self.lock:
+            self.dictionary = self.generation = None
+            self.built = 0
+
+
+dictionary_cache = DictionaryCache()
+
+
+def get_dictionary(indexes, min_interval=0):
+    """Return the term dictionary for the indexes. If they have changed since
+    it was built it is rebuilt in the background, at most once every
+    min_interval seconds."""
+    return dictionary_cache.get(indexes, min_interval)
@@ -0,0 +1,5 @@
+from app import create_app
+
+
+# The application shared by all of the tests
+app = create_app()
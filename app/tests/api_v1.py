@@ -1,9 +1,12 @@
 import unittest
 import json
+import shutil
 
-from app import app, db
-from app.model.document import Document, get_index
-from app.model.tag import Tag
+from app import db
+from app.tests import app
+from app.model.document import Document, CompressedText, get_index
+from app.model.tag import Tag, tag_cache
+from app.index_queue import IndexQueue
 
 
 #-----------------------------------------------------------------------------#
@@ -18,6 +21,7 @@ class BaseTestCase(unittest.TestCase):
         db.create_all()
 
     def tearDown(self):
+        tag_cache.clear()
         db.session.remove()
         db.drop_all()
 
@@ -97,6 +101,57 @@ class DocumentAPITestCase(BaseTestCase):
         self.assertTrue(doc.deleted)
 
 
+    def test_text_too_long(self):
+        app.config['DOCUMENT_MAX_LENGTH'] = 5
+        try:
+            rv = self.app.post(u'/api/v1.0/document',
+                               data=json.dumps({u"title": u"Test Title",
+                                                u"text": u"Test Text"}),
+                               content_type='application/json')
+        finally:
+            app.config['DOCUMENT_MAX_LENGTH'] = 1000000
+        self.assertEqual(rv.status_code, 400)
+        self.assertEqual(Document.query.count(), 0)
+
+
+#-----------------------------------------------------------------------------#
+class IndexAPITestCase(BaseTestCase):
+    def setUp(self):
+        BaseTestCase.setUp(self)
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+
+    def tearDown(self):
+        BaseTestCase.tearDown(self)
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+
+    def test_size(self):
+        self._index_doc(self._add_default_doc())
+        rv = self.app.get(u'/api/v1.0/index')
+        rv_json = json.loads(rv.data)
+        self.assertEqual(rv_json[u'doc_count'], 1)
+        self.assertTrue(rv_json[u'size'] > 0)
+        self.assertEqual(rv_json[u'bytes_per_doc'], rv_json[u'size'])
+
+
+#-----------------------------------------------------------------------------#
+class DocumentListTextTestCase(BaseTestCase):
+    def test_text_not_loaded_for_min_details(self):
+        self._add_default_doc()
+        db.session.remove()
+        process_result_value = CompressedText.process_result_value
+        def _fail(*args):
+            raise AssertionError("text was loaded")
+        CompressedText.process_result_value = _fail
+        try:
+            rv = self.app.get(u'/api/v1.0/document')
+        finally:
+            CompressedText.process_result_value = process_result_value
+        self.assertEqual(rv.status_code, 200)
+        rv = self.app.get(u'/api/v1.0/document?details=all')
+        self.assertEqual(json.loads(rv.data)[u'results'][0][u'text'],
+                         u"Test Text")
+
+
 #-----------------------------------------------------------------------------#
 class DocumentTagAPITestCase(BaseTestCase):
     def test_delete_tag_from_document(self):
@@ -128,6 +183,72 @@ class DocumentTagAPITestCase(BaseTestCase):
         self.assertEqual(doc.tags[0].id, 1)
 
 
+#-----------------------------------------------------------------------------#
+class TagDocumentsAPITestCase(BaseTestCase):
+    def setUp(self):
+        BaseTestCase.setUp(self)
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+        self._add_default_tag()
+        self.docs = [Document(u"Title {}".format(i), u"Text {}".format(i))
+                     for i in range(4)]
+        db.session.add_all(self.docs)
+        db.session.commit()
+
+    def _bulk(self, method, data, tag_id=1):
+        return method(u'/api/v1.0/tag/{}/documents'.format(tag_id),
+                      data=json.dumps(data), content_type='application/json')
+
+    def _tagged(self):
+        db.session.expire_all()
+        return [doc.id for doc in Document.query.order_by(Document.id)
+                if doc.tags]
+
+    def test_tag_by_ids(self):
+        self.docs[0].tags.append(Tag.query.get(1))
+        self.docs[3].delete()
+        db.session.commit()
+        queue = IndexQueue(app.config['INDEX_QUEUE'])
+        queue.redis.delete(queue.key)
+        rv = self._bulk(self.app.post, {u'ids': [1, 2, 3, 4, 99]})
+        rv_json = json.loads(rv.data)
+        self.assertEqual(rv_json[u'matched'], 5)
+        self.assertEqual(rv_json[u'changed'], 2)
+        self.assertEqual(rv_json[u'tag'][u'id'], 1)
+        self.assertEqual(self._tagged(), [1, 2, 3])
+        # Only the documents that were tagged are reindexed
+        self.assertEqual(sorted(queue.reserve(10)), [2, 3])
+        queue.redis.delete(queue.key, queue.processing_key)
+
+    def test_untag_by_ids(self):
+        self._bulk(self.app.post, {u'ids': [1, 2, 3]})
+        rv = self._bulk(self.app.delete, {u'ids': [2, 3]})
+        self.assertEqual(json.loads(rv.data)[u'changed'], 2)
+        self.assertEqual(self._tagged(), [1])
+
+    def test_tag_by_query(self):
+        for doc in self.docs[:2]:
+            self._index_doc(doc)
+        rv = self._bulk(self.app.post, {u'query': u'title:title'})
+        self.assertEqual(json.loads(rv.data)[u'matched'], 2)
+        self.assertEqual(self._tagged(), [1, 2])
+
+    def test_deleted_documents_not_tagged(self):
+        self.docs[0].delete()
+        db.session.commit()
+        self._bulk(self.app.post, {u'ids': [1, 2]})
+        self.assertEqual(self._tagged(), [2])
+
+    def test_ids_or_query_required(self):
+        rv = self._bulk(self.app.post, {})
+        self.assertEqual(rv.status_code, 400)
+        rv = self._bulk(self.app.post, {u'ids': [1], u'query': u'text'})
+        self.assertEqual(rv.status_code, 400)
+
+    def test_missing_tag(self):
+        rv = self._bulk(self.app.post, {u'ids': [1]}, tag_id=5)
+        self.assertEqual(rv.status_code, 404)
+
+
 #-----------------------------------------------------------------------------#
 class DocumentListAPITestCase(BaseTestCase):
     def test_get_document_with_empty_db(self):
@@ -227,6 +348,19 @@ class TagAPITestCase(BaseTestCase):
         self.assertEqual(tag.title, u"Test Update Title")
         self.assertEqual(tag.description, u"Test Update")
 
+    def test_update_tag_invalidates_cache(self):
+        self._add_default_tag()
+        tag_cache.get_many([1])
+        db.session.remove()
+        updated_data = {"title": "Test Update Title"}
+        self.app.put('/api/v1.0/tag/1', data=json.dumps(updated_data),
+                     content_type='application/json')
+        data = {u"title": u"Test Title", u"text": u"Test Text", "tags": [1]}
+        rv = self.app.post(u'/api/v1.0/document', data=json.dumps(data),
+                           content_type='application/json')
+        rv_json = json.loads(rv.data)
+        self.assertEqual(rv_json[u'tags'][0][u'title'], u"Test Update Title")
+
 
 #-----------------------------------------------------------------------------#
 class TagListAPITestCase(BaseTestCase):
@@ -277,12 +411,31 @@ class DocumentSearchAPITestCase(BaseTestCase):
         self.assertEqual(rv_json[u'meta'][u'per_page'], 3)
         self.assertEqual(rv_json[u'meta'][u'reverse'], True)
 
-    def test_broken_query(self):
+    def test_numeric_query(self):
         doc = self._add_default_doc()
         self._index_doc(doc)
         rv = self.app.get(u'/api/v1.0/document/search?query=id:1')
         rv_json = json.loads(rv.data)
-        self.assertEqual(rv_json[u'query'], u':(')
+        self.assertEqual(rv_json[u'query'], u'id:1')
+        self.assertEqual(rv_json[u'hits'][0][u'id'], 1)
+
+    def test_broken_query(self):
+        rv = self.app.get(u'/api/v1.0/document/search?query=id:abc')
+        self.assertEqual(rv.status_code, 400)
+        rv = self.app.get(u'/api/v1.0/document/search?query=created:>blah')
+        self.assertEqual(rv.status_code, 400)
+
+    def test_snippet_from_compressed_text(self):
+        app.config['INDEX_STORED_TEXT'] = 'zlib'
+        try:
+            doc = self._add_default_doc()
+            self._index_doc(doc)
+        finally:
+            app.config['INDEX_STORED_TEXT'] = 'full'
+        rv = self.app.get(u'/api/v1.0/document/search?query=text'
+                          u'&fields=id,snippet')
+        rv_json = json.loads(rv.data)
+        self.assertTrue(u'Text' in rv_json[u'hits'][0][u'snippet'])
 
     def test_query(self):
         doc = self._add_default_doc()
@@ -293,4 +446,4 @@ class DocumentSearchAPITestCase(BaseTestCase):
         self.assertEqual(rv_json[u'meta'][u'page'], 1)
         self.assertEqual(rv_json[u'meta'][u'total'], 1)
         self.assertEqual(rv_json[u'hits'][0][u'id'], 1)
-        self.assertEqual(rv_json[u'query'], u'text:test')
+        self.assertEqual(rv_json[u'query'], u'(text:test OR title:test^2.0)')
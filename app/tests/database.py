@@ -0,0 +1,102 @@
+import json
+import os
+import unittest
+
+from sqlalchemy import create_engine, exc
+
+from app import db, lib
+from app.tests import app
+from app.database import TimedQueuePool, ping_connection
+from app.model.document import Document
+
+
+#-----------------------------------------------------------------------------#
+class BaseTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['INDEX_QUEUE'] = 'test_index'
+        self.app = app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+
+#-----------------------------------------------------------------------------#
+class PoolTestCase(unittest.TestCase):
+    db_file = '/tmp/searchr/test_pool.db'
+
+    def setUp(self):
+        lib.ensure_dir(os.path.dirname(self.db_file))
+
+    def tearDown(self):
+        if os.path.exists(self.db_file):
+            os.remove(self.db_file)
+
+    def test_checkout_waits_recorded(self):
+        engine = create_engine('sqlite:///' + self.db_file,
+                               poolclass=TimedQueuePool, pool_size=1,
+                               max_overflow=0,
+                               pool_events=[(ping_connection, 'checkout')])
+        for i in range(2):
+            engine.execute("SELECT 1")
+        stats = engine.pool.stats.as_dict()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertTrue(stats['wait_max'] >= stats['wait_mean'] >= 0)
+
+    def test_ping_dead_connection(self):
+        class Cursor(object):
+            def execute(self, sql):
+                raise Exception("server closed the connection")
+            def close(self):
+                pass
+        class Connection(object):
+            def cursor(self):
+                return Cursor()
+        with self.assertRaises(exc.DisconnectionError):
+            ping_connection(Connection(), None, None)
+
+
+#-----------------------------------------------------------------------------#
+class ReadReplicaTestCase(BaseTestCase):
+    replica_file = '/tmp/searchr/test_replica.db'
+
+    def setUp(self):
+        BaseTestCase.setUp(self)
+        lib.ensure_dir(os.path.dirname(self.replica_file))
+        app.config['SQLALCHEMY_BINDS'] = {
+            'replica': 'sqlite:///' + self.replica_file}
+        app.config['SQLALCHEMY_READ_BIND'] = 'replica'
+        engine = db.get_engine(app, bind='replica')
+        db.Model.metadata.create_all(bind=engine)
+        engine.execute(Document.__table__.insert(), id=1, title=u"Replica",
+                       text=u"Test Text", deleted=False)
+
+    def tearDown(self):
+        db.read_session.remove()
+        app.config['SQLALCHEMY_BINDS'] = None
+        app.config['SQLALCHEMY_READ_BIND'] = None
+        if os.path.exists(self.replica_file):
+            os.remove(self.replica_file)
+        BaseTestCase.tearDown(self)
+
+    def test_reads_from_replica(self):
+        rv = self.app.get(u'/api/v1.0/document/1')
+        self.assertEqual(json.loads(rv.data)[u'title'], u"Replica")
+        rv_json = json.loads(self.app.get(u'/api/v1.0/document').data)
+        self.assertEqual(rv_json[u'meta'][u'total'], 1)
+
+    def test_writes_to_primary(self):
+        data = {u"title": u"Primary", u"text": u"Test Text"}
+        self.app.post(u'/api/v1.0/document/2', data=json.dumps(data),
+                      content_type=u'application/json')
+        self.assertEqual(Document.query.get(2).title, u"Primary")
+        rv = self.app.get(u'/api/v1.0/document/2')
+        self.assertEqual(rv.status_code, 404)
+
+    def test_stats(self):
+        rv_json = json.loads(self.app.get(u'/api/v1.0/stats').data)
+        self.assertEqual(sorted(rv_json[u'db_pools'].keys()),
+                         [u'default', u'read'])
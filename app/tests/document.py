@@ -0,0 +1,149 @@
+import unittest
+from datetime import datetime, timedelta
+
+from app import db
+from app.tests import app
+from app.model.document import Document, purge_deleted, tags_to_documents,\
+    stored_text, index_text, COMPRESSED_PREFIX
+from app.model.tag import Tag, tag_cache
+
+
+#-----------------------------------------------------------------------------#
+class BaseTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['INDEX_QUEUE'] = 'test_index'
+        self.app = app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        tag_cache.clear()
+        db.session.remove()
+        db.drop_all()
+
+    def _add_docs(self, count, tags=[]):
+        docs = [Document(u"Test Title", u"Test Text", tags)
+                for i in range(count)]
+        db.session.add_all(docs)
+        db.session.commit()
+        return docs
+
+
+#-----------------------------------------------------------------------------#
+class PurgeDeletedTestCase(BaseTestCase):
+    def test_purge_old_deleted(self):
+        tag = Tag(u"Test Title")
+        db.session.add(tag)
+        docs = self._add_docs(5, [tag])
+        for doc in docs[:3]:
+            doc.delete()
+            doc.updated = datetime.utcnow() - timedelta(days=10)
+        docs[3].delete()
+        db.session.commit()
+
+        purged = purge_deleted(datetime.utcnow() - timedelta(days=1),
+                               chunk_size=2)
+        self.assertEqual(purged, 3)
+        self.assertEqual(sorted(i.id for i in Document.query.all()), [4, 5])
+        links = db.session.query(tags_to_documents.c.document_id).all()
+        self.assertEqual(sorted(i for (i,) in links), [4, 5])
+        self.assertEqual(Tag.query.get(1).documents.count(), 2)
+
+    def test_purge_nothing_deleted(self):
+        self._add_docs(2)
+        self.assertEqual(purge_deleted(datetime.utcnow()), 0)
+        self.assertEqual(Document.query.count(), 2)
+
+
+#-----------------------------------------------------------------------------#
+class DocumentTagsTestCase(BaseTestCase):
+    def test_tag_ids(self):
+        db.session.add_all([Tag(u"One"), Tag(u"Two")])
+        db.session.commit()
+        doc = self._add_docs(1, [1, 2, 1])[0]
+        self.assertEqual(sorted(i.title for i in doc.tags), [u"One", u"Two"])
+
+    def test_invalid_tag_id(self):
+        with self.assertRaises(ValueError):
+            Document(u"Test Title", u"Test Text", [1])
+
+    def test_add_tags_skips_existing(self):
+        tag = Tag(u"One")
+        doc = self._add_docs(1, [tag])[0]
+        doc.add_tags([tag, tag])
+        self.assertEqual(len(doc.tags), 1)
+
+
+#-----------------------------------------------------------------------------#
+class IndexesTestCase(BaseTestCase):
+    def test_indexed_columns(self):
+        from sqlalchemy import inspect
+        inspector = inspect(db.engine)
+        columns = [i['column_names'] for i in inspector.get_indexes('document')]
+        self.assertTrue(['deleted'] in columns)
+        self.assertTrue(['updated'] in columns)
+        columns = [i['column_names']
+                   for i in inspector.get_indexes('tags_to_documents')]
+        self.assertTrue(['document_id'] in columns)
+
+
+#-----------------------------------------------------------------------------#
+class TextCompressionTestCase(BaseTestCase):
+    def tearDown(self):
+        app.config['DB_COMPRESS_TEXT'] = False
+        app.config['DB_COMPRESS_MIN_LENGTH'] = 1024
+        app.config['INDEX_STORED_TEXT'] = 'full'
+        BaseTestCase.tearDown(self)
+
+    def _raw_text(self, doc_id):
+        return db.session.execute(
+            "SELECT text FROM document WHERE id = :id", {'id': doc_id}).scalar()
+
+    def test_stored_text(self):
+        text = u"Test Text \u00e9" * 100
+        self.assertEqual(stored_text(text), text)
+        self.assertEqual(stored_text(text, 'snippet', 10), text[:10])
+        compressed = stored_text(text, 'zlib')
+        self.assertTrue(len(compressed) < len(text))
+        self.assertEqual(index_text(compressed), text)
+        self.assertEqual(index_text(text), text)
+        self.assertRaises(ValueError, stored_text, text, 'gzip')
+
+    def test_prepare(self):
+        doc = self._add_docs(1)[0]
+        self.assertFalse('_stored_text' in doc.prepare())
+        app.config['INDEX_STORED_TEXT'] = 'zlib'
+        prepared = doc.prepare()
+        self.assertEqual(prepared['text'], u"Test Text")
+        self.assertEqual(index_text(prepared['_stored_text']), u"Test Text")
+
+    def test_db_compression(self):
+        app.config['DB_COMPRESS_TEXT'] = True
+        app.config['DB_COMPRESS_MIN_LENGTH'] = 20
+        text = u"Test Text " * 10
+        docs = [Document(u"Short", u"Test Text"), Document(u"Long", text)]
+        db.session.add_all(docs)
+        db.session.commit()
+        self.assertEqual(self._raw_text(docs[0].id), u"Test Text")
+        raw = self._raw_text(docs[1].id)
+        self.assertTrue(raw.startswith(COMPRESSED_PREFIX))
+        self.assertTrue(len(raw) < len(text))
+        db.session.expire_all()
+        self.assertEqual(Document.query.get(docs[1].id).text, text)
+
+    def test_text_with_prefix_round_trips(self):
+        text = COMPRESSED_PREFIX + u"Test Text"
+        for compress in (False, True):
+            app.config['DB_COMPRESS_TEXT'] = compress
+            doc = Document(u"Test Title", text)
+            db.session.add(doc)
+            db.session.commit()
+            db.session.expire_all()
+            self.assertEqual(Document.query.get(doc.id).text, text)
+
+    def test_uncompressed_rows_read(self):
+        doc = self._add_docs(1)[0]
+        app.config['DB_COMPRESS_TEXT'] = True
+        db.session.expire_all()
+        self.assertEqual(Document.query.get(doc.id).text, u"Test Text")
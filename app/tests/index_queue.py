@@ -0,0 +1,164 @@
+import os
+import shutil
+import unittest
+
+from app import db
+from app.tests import app
+from app.index_queue import IndexQueue
+from app.model.document import Document, get_indexes
+from app.reconcile import read_high_water_mark
+import index_deamon
+from index_deamon import IndexDeamon
+
+
+#-----------------------------------------------------------------------------#
+class IndexQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.queue = IndexQueue('test_index_queue', max_retries=2, backoff=10)
+        self._clear()
+
+    def tearDown(self):
+        self._clear()
+
+    def _clear(self):
+        self.queue.redis.delete(self.queue.key, self.queue.processing_key,
+                                self.queue.delayed_key, self.queue.retries_key,
+                                self.queue.failed_key)
+
+    def test_reserve_in_order(self):
+        self.queue.put(1, 2, 3)
+        self.queue.put(4)
+        self.assertEqual(self.queue.reserve(3), [1, 2, 3])
+        self.assertEqual(self.queue.reserve(3), [4])
+        self.assertEqual(self.queue.reserve(3, timeout=1), [])
+
+    def test_ack(self):
+        self.queue.put(1, 2)
+        self.queue.reserve(2)
+        self.assertEqual(self.queue.redis.llen(self.queue.processing_key), 2)
+        self.queue.ack(1, 2)
+        self.assertEqual(self.queue.redis.llen(self.queue.processing_key), 0)
+
+    def test_recover(self):
+        self.queue.put(1, 2)
+        self.queue.reserve(2)
+        self.assertEqual(self.queue.recover(), 2)
+        self.assertEqual(self.queue.reserve(2), [1, 2])
+
+    def test_retry_with_backoff(self):
+        self.queue.put(1)
+        self.queue.reserve(1)
+        self.assertTrue(self.queue.retry(1))
+        self.assertEqual(self.queue.promote_delayed(), 0)
+        delay = self.queue.redis.zscore(self.queue.delayed_key,
+                                        self.queue.redis.zrange(
+                                            self.queue.delayed_key, 0, 0)[0])
+        self.assertEqual(self.queue.promote_delayed(now=delay), 1)
+        self.assertEqual(self.queue.reserve(1), [1])
+
+    def test_retry_gives_up(self):
+        self.queue.put(1)
+        for i in range(2):
+            self.queue.reserve(1)
+            self.assertTrue(self.queue.retry(1))
+            self.queue.promote_delayed(now=float('inf'))
+        self.queue.reserve(1)
+        self.assertFalse(self.queue.retry(1))
+        self.assertEqual(self.queue.redis.llen(self.queue.failed_key), 1)
+        self.assertEqual(self.queue.promote_delayed(now=float('inf')), 0)
+
+
+#-----------------------------------------------------------------------------#
+class IndexDeamonTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['INDEX_QUEUE'] = 'test_index_deamon'
+        self.index_dir = '/tmp/searchr/test_deamon_ix'
+        app.config['WHOOSH_INDEX_DIR'] = self.index_dir
+        app.config['WHOOSH_INDEX_SHARDS'] = 2
+        # The in memory test DB can't be seen from worker processes
+        app.config['INDEX_WORKERS'] = 0
+        db.create_all()
+        self.deamon = IndexDeamon(app.config)
+        self.queue = self.deamon.queue
+        self.queue.redis.delete(self.queue.key, self.queue.processing_key)
+
+    def tearDown(self):
+        app.config['WHOOSH_INDEX_SHARDS'] = 1
+        app.config['INDEX_WORKERS'] = 2
+        app.config['WHOOSH_PUBLISH_DIR'] = None
+        self.queue.redis.delete(self.queue.key, self.queue.processing_key,
+                                self.queue.delayed_key, self.queue.retries_key,
+                                self.queue.failed_key)
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+
+    def _add_docs(self, count):
+        docs = [Document(u"Title {}".format(i), u"test") for i in range(count)]
+        db.session.add_all(docs)
+        db.session.commit()
+        return [doc.id for doc in docs]
+
+    def _doc_count(self):
+        return sum(ix.doc_count() for ix in get_indexes(self.index_dir, 2))
+
+    def test_batch(self):
+        ids = self._add_docs(5)
+        self.queue.put(*ids)
+        self.deamon.run_once()
+        self.assertEqual(self._doc_count(), 5)
+        self.assertEqual(self.queue.redis.llen(self.queue.processing_key), 0)
+        self.assertTrue(read_high_water_mark(self.index_dir) is not None)
+
+    def test_deleted_docs_removed(self):
+        ids = self._add_docs(3)
+        self.queue.put(*ids)
+        self.deamon.run_once()
+        doc = Document.query.get(ids[0])
+        doc.deleted = True
+        db.session.commit()
+        self.queue.put(ids[0], 1000)
+        self.deamon.run_once()
+        self.assertEqual(self._doc_count(), 2)
+
+    def test_failed_batch_is_retried(self):
+        ids = self._add_docs(2)
+        self.queue.put(*ids)
+        def _fail(doc_ids):
+            raise RuntimeError("DB went away")
+        self.deamon.fetch = _fail
+        self.deamon.run_once()
+        self.assertEqual(self._doc_count(), 0)
+        self.assertEqual(self.queue.redis.llen(self.queue.processing_key), 0)
+        self.assertEqual(self.queue.redis.zcard(self.queue.delayed_key), 2)
+
+    def test_publish_failure_logged(self):
+        # A file where the publish directory should be
+        publish_dir = os.path.join(self.index_dir, 'not-a-dir')
+        app.config['WHOOSH_PUBLISH_DIR'] = publish_dir
+        ids = self._add_docs(2)
+        with open(publish_dir, 'w') as f:
+            f.write('')
+        self.queue.put(*ids)
+        self.deamon.run_once()
+        self.assertEqual(self._doc_count(), 2)
+        # Tried and failed, so tried again after INDEX_PUBLISH_PERIOD
+        self.assertTrue(self.deamon.last_publish > 0)
+        self.assertTrue(self.deamon.unpublished)
+        self.assertEqual(self.queue.redis.llen(self.queue.processing_key), 0)
+
+    def test_high_water_mark_failure_logged(self):
+        ids = self._add_docs(2)
+        self.queue.put(*ids)
+        write_high_water_mark = index_deamon.write_high_water_mark
+        def _fail(*args):
+            raise IOError("No space left on device")
+        index_deamon.write_high_water_mark = _fail
+        try:
+            self.assertTrue(self.deamon.process(self.queue.reserve(2)))
+        finally:
+            index_deamon.write_high_water_mark = write_high_water_mark
+        self.assertEqual(self._doc_count(), 2)
+        self.assertEqual(self.queue.redis.llen(self.queue.processing_key), 0)
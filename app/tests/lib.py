@@ -2,9 +2,10 @@ import json
 import os
 import unittest
 
-from app import app, db
+from app import db
+from app.tests import app
 from app.model.document import Document
-from app.model.tag import Tag
+from app.model.tag import Tag, tag_cache
 from app import lib
 
 
@@ -18,6 +19,7 @@ class BaseTestCase(unittest.TestCase):
         db.create_all()
 
     def tearDown(self):
+        tag_cache.clear()
         db.session.remove()
         db.drop_all()
 
@@ -83,9 +85,40 @@ class LibTestCase(BaseTestCase):
         self.assertEqual((res[0].id), 1)
         self.assertEqual(type(res[0]), Tag)
 
+    def test_tag_list_validator_not_ids(self):
+        with self.assertRaises(ValueError) as cm:
+            res = lib.tag_list([u'a'], u'Tag List')
+        self.assertEqual(cm.exception.message,
+                         "Tag List needs to be a list of Tag ids")
+
+    def test_tag_list_validator_cached(self):
+        self._add_default_tag()
+        lib.tag_list([1], u'Tag List')
+        # Removed without invalidating, so only the cache knows about it
+        db.session.execute(Tag.__table__.delete())
+        db.session.commit()
+        db.session.remove()
+        res = lib.tag_list([1], u'Tag List')
+        self.assertEqual(res[0].title, u"Test Title")
+        self.assertTrue(res[0] in db.session)
+        tag_cache.invalidate(1)
+        db.session.remove()
+        with self.assertRaises(ValueError):
+            lib.tag_list([1], u'Tag List')
+
     def test_ensure_dir(self):
         test_dir = "/tmp/searchr/test"
         self.assertFalse(os.path.exists(test_dir))
         lib.ensure_dir(test_dir)
         self.assertTrue(os.path.exists(test_dir))
         os.rmdir(test_dir)
+
+    def test_lru_cache(self):
+        cache = lib.LRUCache(2)
+        cache.set(1, u'a')
+        cache.set(2, u'b')
+        self.assertEqual(cache.get(1), u'a')
+        cache.set(3, u'c')
+        self.assertEqual(cache.get(2), None)
+        self.assertEqual(cache.get(1), u'a')
+        self.assertEqual(len(cache), 2)
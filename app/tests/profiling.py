@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import shutil
+import unittest
+
+from app import db
+from app.tests import app
+from app.model.document import Document, get_index
+from app.profiling import slow_query_log
+
+
+#-----------------------------------------------------------------------------#
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record.getMessage())
+
+
+class BaseTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['INDEX_QUEUE'] = 'test_index'
+        self.index_dir = '/tmp/searchr/test_profile_ix'
+        self.profile_dir = '/tmp/searchr/test_profiles'
+        app.config['WHOOSH_INDEX_DIR'] = self.index_dir
+        app.config['PROFILE_DIR'] = self.profile_dir
+        self.app = app.test_client()
+        db.create_all()
+        doc = Document(u"Test Title", u"Test Text")
+        db.session.add(doc)
+        db.session.commit()
+        writer = get_index(self.index_dir).writer()
+        writer.update_document(**doc.prepare())
+        writer.commit()
+
+    def tearDown(self):
+        app.config['PROFILE_ENABLED'] = False
+        app.config['PROFILE_SAMPLE_RATE'] = 0.0
+        app.config['SLOW_QUERY_THRESHOLD'] = 500
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def _profiles(self):
+        if not os.path.exists(self.profile_dir):
+            return []
+        return sorted(os.listdir(self.profile_dir))
+
+
+#-----------------------------------------------------------------------------#
+class ProfileTestCase(BaseTestCase):
+    def test_disabled(self):
+        self.app.get(u'/api/v1.0/document/search?query=test',
+                     headers={'X-Searchr-Profile': '1'})
+        self.assertEqual(self._profiles(), [])
+
+    def test_header(self):
+        app.config['PROFILE_ENABLED'] = True
+        self.app.get(u'/api/v1.0/document/search?query=test')
+        self.assertEqual(self._profiles(), [])
+        self.app.get(u'/api/v1.0/document/search?query=test',
+                     headers={'X-Searchr-Profile': '1'})
+        profiles = self._profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].startswith('searchapi-'))
+
+    def test_sample_rate(self):
+        app.config['PROFILE_ENABLED'] = True
+        app.config['PROFILE_SAMPLE_RATE'] = 1.0
+        self.app.get(u'/api/v1.0/document')
+        self.app.get(u'/api/v1.0/ping')
+        profiles = self._profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].startswith('documentlistapi-'))
+
+
+#-----------------------------------------------------------------------------#
+class SlowQueryLogTestCase(BaseTestCase):
+    def setUp(self):
+        BaseTestCase.setUp(self)
+        self.handler = ListHandler()
+        slow_query_log.addHandler(self.handler)
+
+    def tearDown(self):
+        slow_query_log.removeHandler(self.handler)
+        BaseTestCase.tearDown(self)
+
+    def test_fast_query_not_logged(self):
+        self.app.get(u'/api/v1.0/document/search?query=test')
+        self.assertEqual(self.handler.records, [])
+
+    def test_slow_query_logged(self):
+        app.config['SLOW_QUERY_THRESHOLD'] = 0
+        self.app.get(u'/api/v1.0/document/search?query=test')
+        entry = json.loads(self.handler.records[0])
+        self.assertEqual(entry[u'query'], u'test')
+        self.assertEqual(entry[u'parsed'], u'(text:test OR title:test^2.0)')
+        self.assertEqual(entry[u'scoring'], u'bm25f')
+        self.assertEqual(entry[u'hits'], 1)
+        self.assertEqual(sorted(entry[u'timings'].keys()),
+                         [u'parse', u'process', u'search'])
@@ -0,0 +1,92 @@
+import shutil
+import unittest
+from datetime import datetime, timedelta
+
+from app import db
+from app.tests import app
+from app.model.document import Document, get_indexes
+from app import reconcile
+
+
+#-----------------------------------------------------------------------------#
+class BaseTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['INDEX_QUEUE'] = 'test_index'
+        self.index_dir = '/tmp/searchr/test_reconcile_ix'
+        self.indexes = get_indexes(self.index_dir, 2)
+        self.app = app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+
+    def _add_docs(self, count):
+        docs = [Document(u"Test Title", u"Test Text") for i in range(count)]
+        db.session.add_all(docs)
+        db.session.commit()
+        return docs
+
+    def _index_docs(self, docs):
+        for doc in docs:
+            writer = self.indexes[doc.id % 2].writer()
+            writer.update_document(**doc.prepare())
+            writer.commit()
+
+    def _reconcile(self, high_water_mark=None):
+        return sorted(reconcile.reconcile(self.indexes, high_water_mark,
+                                          batch_size=2))
+
+
+#-----------------------------------------------------------------------------#
+class ReconcileTestCase(BaseTestCase):
+    def test_nothing_to_do(self):
+        self._index_docs(self._add_docs(5))
+        self.assertEqual(self._reconcile(), [])
+
+    def test_new_and_missing(self):
+        docs = self._add_docs(4)
+        self._index_docs(docs[:2])
+        docs[2].updated = datetime.utcnow() - timedelta(days=1)
+        db.session.commit()
+        high_water_mark = datetime.utcnow() - timedelta(hours=1)
+        self.assertEqual(self._reconcile(high_water_mark),
+                         [(3, 'missing'), (4, 'new')])
+
+    def test_changed(self):
+        docs = self._add_docs(3)
+        self._index_docs(docs)
+        docs[1].update(u"Changed", u"Changed")
+        db.session.commit()
+        self.assertEqual(self._reconcile(), [(2, 'changed')])
+
+    def test_deleted(self):
+        docs = self._add_docs(5)
+        self._index_docs(docs)
+        docs[0].delete()
+        db.session.delete(docs[4])
+        db.session.commit()
+        self.assertEqual(self._reconcile(), [(1, 'deleted'), (5, 'deleted')])
+
+    def test_deleted_not_in_index(self):
+        docs = self._add_docs(2)
+        self._index_docs(docs[:1])
+        docs[1].delete()
+        db.session.commit()
+        self.assertEqual(self._reconcile(), [])
+
+
+#-----------------------------------------------------------------------------#
+class HighWaterMarkTestCase(BaseTestCase):
+    def test_no_high_water_mark(self):
+        self.assertEqual(reconcile.read_high_water_mark(self.index_dir), None)
+
+    def test_only_moves_forward(self):
+        now = datetime.utcnow()
+        reconcile.write_high_water_mark(self.index_dir, now)
+        reconcile.write_high_water_mark(self.index_dir,
+                                        now - timedelta(days=1))
+        self.assertEqual(reconcile.read_high_water_mark(self.index_dir), now)
@@ -0,0 +1,51 @@
+import json
+import shutil
+import unittest
+
+from app.tests import app
+from replay import InProcessTarget, endpoint_name, percentile, read_log,\
+    replay, summarise
+
+
+#-----------------------------------------------------------------------------#
+class ReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.index_dir = '/tmp/searchr/test_replay_ix'
+        app.config['WHOOSH_INDEX_DIR'] = self.index_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+
+    def test_read_log(self):
+        lines = [json.dumps({'path': '/api/v1.0/ping'}), '',
+                 json.dumps({'request_id': 'not a request'}),
+                 json.dumps({'method': 'post', 'path': '/api/v1.0/tag',
+                             'body': {'title': 'Test'}})]
+        self.assertEqual(read_log(lines),
+                         [('GET', '/api/v1.0/ping', None),
+                          ('POST', '/api/v1.0/tag', {'title': 'Test'})])
+
+    def test_endpoint_name(self):
+        self.assertEqual(endpoint_name('GET', '/api/v1.0/document/12/tag/3'),
+                         u'GET /api/v1.0/document/<id>/tag/<id>')
+        self.assertEqual(endpoint_name('GET', '/api/v1.0/v2?query=1'),
+                         u'GET /api/v1.0/v2')
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([5], 90), 5)
+        self.assertEqual(percentile([], 90), 0.0)
+
+    def test_replay_in_process(self):
+        requests = [('GET', '/api/v1.0/ping', None)] * 6 + \
+                   [('GET', '/api/v1.0/document/search?query=test', None)] * 2
+        results, elapsed = replay(InProcessTarget(app), requests,
+                                  concurrency=2, rate=200)
+        self.assertTrue(elapsed >= 7 / 200.0)
+        rows = dict((i['endpoint'], i) for i in summarise(results, elapsed))
+        self.assertEqual(rows[u'GET /api/v1.0/ping']['requests'], 6)
+        self.assertEqual(rows[u'GET /api/v1.0/document/search']['errors'], 0)
+        self.assertEqual(rows[u'all']['requests'], 8)
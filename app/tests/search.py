@@ -0,0 +1,311 @@
+import json
+import shutil
+import unittest
+
+from app import db
+from app.tests import app
+from app.lib import LRUCache
+from app.model.document import Document, get_indexes, shard_for, doc_schema,\
+    VarBytesColumn
+from app.search import ShardSearcher, QueryError, SortError, get_parser,\
+    parse_query, get_weighting, WEIGHTINGS
+from whoosh import qparser
+from whoosh import columns
+from whoosh.fields import TEXT
+from whoosh.searching import Hit
+
+
+#-----------------------------------------------------------------------------#
+class BaseTestCase(unittest.TestCase):
+    shards = 3
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['INDEX_QUEUE'] = 'test_index'
+        self.index_dir = '/tmp/searchr/test_shard_ix'
+        app.config['WHOOSH_INDEX_DIR'] = self.index_dir
+        app.config['WHOOSH_INDEX_SHARDS'] = self.shards
+        self.app = app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        app.config['WHOOSH_INDEX_SHARDS'] = 1
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+
+    def _indexes(self):
+        return get_indexes(self.index_dir, self.shards)
+
+    def _add_docs(self, count):
+        docs = []
+        for i in range(count):
+            doc = Document(u"Title {}".format(i), u"test " * (i + 1))
+            db.session.add(doc)
+            docs.append(doc)
+        db.session.commit()
+        self._index(docs)
+        return docs
+
+    def _index(self, docs):
+        indexes = self._indexes()
+        writers = [ix.writer() for ix in indexes]
+        for doc in docs:
+            writers[shard_for(doc.id, self.shards)].update_document(
+                **doc.prepare())
+        for writer in writers:
+            writer.commit()
+
+    def _search(self, query, **kwargs):
+        return self.app.get(u'/api/v1.0/document/search', query_string=dict(
+            query=query, **kwargs))
+
+
+#-----------------------------------------------------------------------------#
+class ShardSearcherTestCase(BaseTestCase):
+    def test_shard_for(self):
+        self.assertEqual(shard_for(4, 3), 1)
+        self.assertEqual(shard_for(4, 1), 0)
+
+    def test_docs_are_spread_over_shards(self):
+        self._add_docs(6)
+        counts = [ix.doc_count() for ix in self._indexes()]
+        self.assertEqual(counts, [2, 2, 2])
+
+    def test_search_page_merges_shards(self):
+        self._add_docs(7)
+        indexes = self._indexes()
+        query = qparser.QueryParser(u'text', indexes[0].schema).parse(u'test')
+        with ShardSearcher(indexes) as searcher:
+            results = searcher.search_page(query, 1, pagelen=5)
+            hits = [(hit.rank, hit.score) for hit in results]
+            self.assertEqual(len(results), 7)
+            self.assertEqual(results.pagecount, 2)
+        self.assertEqual([i[0] for i in hits], range(5))
+        scores = [i[1] for i in hits]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_scores_match_one_index(self):
+        docs = [Document(u"Title {}".format(i),
+                         u"test " * (i % 4 + 1) + u"rare " * (i % 7 == 0))
+                for i in range(30)]
+        db.session.add_all(docs)
+        db.session.commit()
+        self._index(docs)
+        single_dir = self.index_dir + '-single'
+        writer = get_indexes(single_dir)[0].writer()
+        for doc in docs:
+            writer.update_document(**doc.prepare())
+        writer.commit()
+        query = get_parser(doc_schema, {'title': 2.0, 'text': 1.0}).parse(
+            u'test rare')
+
+        def _scores(indexes, name):
+            with ShardSearcher(indexes, get_weighting(name)) as searcher:
+                results = searcher.search_page(query, 1, pagelen=30)
+                return dict((hit['id'], hit.score) for hit in results)
+        try:
+            for name in WEIGHTINGS:
+                sharded = _scores(self._indexes(), name)
+                single = _scores(get_indexes(single_dir), name)
+                self.assertEqual(sorted(sharded), sorted(single))
+                for doc_id in single:
+                    self.assertAlmostEqual(sharded[doc_id], single[doc_id])
+        finally:
+            shutil.rmtree(single_dir, ignore_errors=True)
+
+    def test_search_page_sorted(self):
+        self._add_docs(5)
+        indexes = self._indexes()
+        query = qparser.QueryParser(u'text', indexes[0].schema).parse(u'test')
+        with ShardSearcher(indexes) as searcher:
+            results = searcher.search_page(query, 1, pagelen=10,
+                                           sortedby=u'created', reverse=True)
+            ids = [hit['id'] for hit in results]
+        self.assertEqual(ids, [5, 4, 3, 2, 1])
+
+    def test_title_column_upgraded(self):
+        # Indexes built with Whoosh's own VarBytesColumn for title
+        schema = doc_schema.copy()
+        schema.remove('title')
+        schema.add('title', TEXT(stored=True, sortable=True))
+        indexes = get_indexes(self.index_dir, self.shards, schema)
+        self.assertTrue(type(indexes[0].schema['title'].column_type)
+                        is columns.VarBytesColumn)
+        self._add_docs(3)
+        for ix in self._indexes():
+            self.assertTrue(isinstance(ix.schema['title'].column_type,
+                                       VarBytesColumn))
+        query = qparser.QueryParser(u'text', doc_schema).parse(u'test')
+        with ShardSearcher(self._indexes()) as searcher:
+            results = searcher.search_page(query, 1, sortedby=u'title')
+            self.assertEqual([hit['title'] for hit in results],
+                             [u'Title 0', u'Title 1', u'Title 2'])
+
+    def test_search_page_sorted_without_column(self):
+        # Indexes built before title had a column
+        schema = doc_schema.copy()
+        schema.remove('title')
+        schema.add('title', TEXT(stored=True))
+        indexes = get_indexes(self.index_dir, self.shards, schema)
+        self._add_docs(4)
+        query = qparser.QueryParser(u'text', schema).parse(u'test')
+        with ShardSearcher(indexes) as searcher:
+            self.assertRaises(SortError, searcher.search_page, query, 1,
+                              sortedby=u'title')
+            self.assertRaises(SortError, searcher.search_page, query, 1,
+                              sortedby=u'tags')
+            self.assertRaises(SortError, searcher.search_page, query, 1,
+                              sortedby=u'nothing')
+            searcher.search_page(query, 1, sortedby=u'id')
+
+
+#-----------------------------------------------------------------------------#
+class ShardedSearchAPITestCase(BaseTestCase):
+    def test_pagination(self):
+        self._add_docs(7)
+        rv_json = json.loads(self._search(u'test', per_page=3, page=3).data)
+        self.assertEqual(rv_json[u'meta'][u'total'], 7)
+        self.assertEqual(rv_json[u'meta'][u'pages'], 3)
+        self.assertEqual(rv_json[u'meta'][u'page'], 3)
+        self.assertEqual(len(rv_json[u'hits']), 1)
+        self.assertEqual(rv_json[u'hits'][0][u'rank'], 6)
+
+    def test_all_pages_cover_all_docs(self):
+        self._add_docs(7)
+        ids = []
+        for page in range(1, 4):
+            rv_json = json.loads(self._search(u'test', per_page=3,
+                                              page=page).data)
+            ids.extend(i[u'id'] for i in rv_json[u'hits'])
+        self.assertEqual(sorted(ids), range(1, 8))
+
+    def test_highlights(self):
+        self._add_docs(2)
+        rv_json = json.loads(self._search(u'test').data)
+        self.assertTrue(u'test' in rv_json[u'hits'][0][u'snippet'])
+
+    def test_fields(self):
+        self._add_docs(2)
+        rv_json = json.loads(self._search(u'test', fields=u'id,title').data)
+        self.assertEqual(sorted(rv_json[u'hits'][0].keys()), [u'id', u'title'])
+        self.assertEqual(rv_json[u'hits'][0][u'title'], u'Title 1')
+
+    def test_fields_read_from_columns(self):
+        self._add_docs(2)
+        stored_fields = Hit.fields
+        def _fail(*args):
+            raise AssertionError("stored fields were loaded")
+        Hit.fields = _fail
+        try:
+            rv = self._search(u'test', fields=u'id,title,score')
+        finally:
+            Hit.fields = stored_fields
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(len(json.loads(rv.data)[u'hits']), 2)
+
+    def test_title_searched(self):
+        self._add_docs(3)
+        rv_json = json.loads(self._search(u'title', fields=u'id').data)
+        self.assertEqual(rv_json[u'meta'][u'total'], 3)
+
+    def test_title_boosted(self):
+        self._add_docs(3)
+        doc = Document(u"test", u"other words")
+        db.session.add(doc)
+        db.session.commit()
+        self._index([doc])
+        rv_json = json.loads(self._search(u'test', fields=u'id').data)
+        self.assertEqual(rv_json[u'hits'][0][u'id'], doc.id)
+
+    def test_scoring(self):
+        self._add_docs(3)
+        rv_json = json.loads(self._search(u'test', scoring=u'frequency').data)
+        self.assertEqual(rv_json[u'meta'][u'scoring'], u'frequency')
+        self.assertEqual(rv_json[u'hits'][0][u'id'], 3)
+        rv = self._search(u'test', scoring=u'magic')
+        self.assertEqual(rv.status_code, 400)
+
+    def test_sort_by_title(self):
+        titles = [u"banana", u"apple", u"date", u"cherry", u"fig", u"elder"]
+        docs = [Document(i, u"test") for i in titles]
+        db.session.add_all(docs)
+        db.session.commit()
+        self._index(docs)
+        rv_json = json.loads(self._search(u'test', sort_field=u'title',
+                                          fields=u'title', per_page=4).data)
+        self.assertEqual([i[u'title'] for i in rv_json[u'hits']],
+                         sorted(titles)[:4])
+
+    def test_sort_by_title_repeatedly(self):
+        docs = [Document(u"Title {:03d}".format(i), u"test")
+                for i in range(300)]
+        db.session.add_all(docs)
+        db.session.commit()
+        self._index(docs)
+        for i in range(20):
+            rv = self._search(u'test', sort_field=u'title', fields=u'title',
+                              per_page=100)
+            self.assertEqual(rv.status_code, 200)
+            titles = [hit[u'title'] for hit in json.loads(rv.data)[u'hits']]
+            self.assertEqual(titles, sorted(titles))
+
+    def test_sort_without_column(self):
+        self._add_docs(3)
+        rv = self._search(u'test', sort_field=u'tags')
+        self.assertEqual(rv.status_code, 400)
+
+    def test_invalid_fields(self):
+        rv = self._search(u'test', fields=u'id,text')
+        self.assertEqual(rv.status_code, 400)
+
+    def test_index_details(self):
+        self._add_docs(4)
+        rv_json = json.loads(self.app.get(u'/api/v1.0/index').data)
+        self.assertEqual(rv_json[u'doc_count'], 4)
+        self.assertEqual(rv_json[u'shards'], 3)
+
+
+#-----------------------------------------------------------------------------#
+class ParseQueryTestCase(unittest.TestCase):
+    def test_parser_is_reused(self):
+        self.assertTrue(get_parser(doc_schema, u'text') is
+                        get_parser(doc_schema, u'text'))
+        self.assertFalse(get_parser(doc_schema, u'text') is
+                         get_parser(doc_schema, u'title'))
+
+    def test_multifield_parser(self):
+        fields = {u'title': 2.0, u'text': 1.0}
+        self.assertTrue(get_parser(doc_schema, fields) is
+                        get_parser(doc_schema, dict(fields)))
+        query, rendered = parse_query(u'test', doc_schema, fields)
+        self.assertEqual(rendered, u'(text:test OR title:test^2.0)')
+
+    def test_weighting(self):
+        weighting = get_weighting('bm25f', {'B': 0.5})
+        self.assertEqual(weighting.B, 0.5)
+        with self.assertRaises(ValueError):
+            get_weighting('magic')
+
+    def test_cached(self):
+        cache = LRUCache()
+        first = parse_query(u'test', doc_schema, u'text', cache)
+        self.assertTrue(parse_query(u'test', doc_schema, u'text', cache)
+                        is first)
+        self.assertEqual(first[1], u'text:test')
+
+    def test_relative_dates_not_cached(self):
+        cache = LRUCache()
+        parse_query(u'created:yesterday', doc_schema, u'text', cache)
+        parse_query(u'created:now', doc_schema, u'text', cache)
+        parse_query(u'test AND updated:>yesterday', doc_schema, u'text', cache)
+        self.assertEqual(len(cache), 0)
+
+    def test_invalid(self):
+        cache = LRUCache()
+        with self.assertRaises(QueryError):
+            parse_query(u'id:abc', doc_schema, u'text', cache)
+        with self.assertRaises(QueryError):
+            parse_query(u'created:[blah to now]', doc_schema, u'text', cache)
+        self.assertEqual(len(cache), 0)
@@ -0,0 +1,177 @@
+import json
+import os
+import shutil
+import unittest
+
+from app import db
+from app.tests import app
+from app.model.document import Document, get_indexes
+from app import snapshot
+from app.suggest import dictionary_cache, get_dictionary
+from sync_deamon import sync_once
+
+
+#-----------------------------------------------------------------------------#
+class BaseTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['INDEX_QUEUE'] = 'test_index'
+        self.base_dir = '/tmp/searchr/test_snapshot'
+        self.index_dir = os.path.join(self.base_dir, 'ix')
+        self.publish_dir = os.path.join(self.base_dir, 'published')
+        self.node_dirs = [os.path.join(self.base_dir, 'node-{}'.format(i))
+                          for i in range(2)]
+        app.config['WHOOSH_INDEX_DIR'] = self.index_dir
+        self.app = app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        app.config['WHOOSH_REPLICA_DIR'] = None
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def _index_doc(self, title, text, shards=1):
+        doc = Document(title, text)
+        db.session.add(doc)
+        db.session.commit()
+        ix = get_indexes(self.index_dir, shards)[doc.id % shards]
+        writer = ix.writer()
+        writer.update_document(**doc.prepare())
+        writer.commit()
+        return doc
+
+
+#-----------------------------------------------------------------------------#
+class PublishTestCase(BaseTestCase):
+    def test_publish(self):
+        self._index_doc(u"Test Title", u"Test Text")
+        self.assertEqual(snapshot.publish(self.index_dir, 1,
+                                          self.publish_dir), 1)
+        manifest = snapshot.read_manifest(self.publish_dir)
+        self.assertEqual(manifest['generation'], 1)
+        self.assertEqual(manifest['shards'], 1)
+        self.assertTrue(os.path.isdir(os.path.join(self.publish_dir,
+                                                   manifest['path'])))
+
+    def test_publish_prunes_old_generations(self):
+        self._index_doc(u"Test Title", u"Test Text")
+        for i in range(4):
+            snapshot.publish(self.index_dir, 1, self.publish_dir, keep=2)
+        names = sorted(i for i in os.listdir(self.publish_dir)
+                       if i.startswith('gen-'))
+        self.assertEqual(names, ['gen-00000003', 'gen-00000004'])
+
+    def test_publish_links_unchanged_files(self):
+        self._index_doc(u"Test Title", u"Test Text")
+        snapshot.publish(self.index_dir, 1, self.publish_dir)
+        doc = Document(u"Test Title", u"Test Text")
+        db.session.add(doc)
+        db.session.commit()
+        # Without merging the first segment is left as it is
+        writer = get_indexes(self.index_dir)[0].writer()
+        writer.update_document(**doc.prepare())
+        writer.commit(merge=False)
+        snapshot.publish(self.index_dir, 1, self.publish_dir)
+        gen_dirs = [os.path.join(self.publish_dir, 'gen-0000000{}'.format(i))
+                    for i in (1, 2)]
+        first = set(os.listdir(gen_dirs[0]))
+        second = set(os.listdir(gen_dirs[1]))
+        self.assertTrue(first & second)
+        self.assertTrue(second - first)
+        for name in first & second:
+            self.assertEqual(os.stat(os.path.join(gen_dirs[0], name)).st_ino,
+                             os.stat(os.path.join(gen_dirs[1], name)).st_ino)
+        for name in second - first:
+            self.assertEqual(
+                os.stat(os.path.join(gen_dirs[1], name)).st_nlink, 1)
+
+    def test_sync_with_nothing_published(self):
+        self.assertEqual(snapshot.sync(self.publish_dir, self.node_dirs[0]),
+                         None)
+
+    def test_sync_deamon_survives_pruned_generation(self):
+        config = {'WHOOSH_PUBLISH_DIR': self.publish_dir,
+                  'WHOOSH_REPLICA_DIR': self.node_dirs[0],
+                  'WHOOSH_KEEP_GENERATIONS': 3}
+        self._index_doc(u"Test Title", u"Test Text")
+        snapshot.publish(self.index_dir, 1, self.publish_dir)
+        self.assertEqual(sync_once(config), 1)
+        snapshot.publish(self.index_dir, 1, self.publish_dir)
+        # Pruned by the publisher before the node copied it
+        shutil.rmtree(os.path.join(self.publish_dir, 'gen-00000002'))
+        self.assertEqual(sync_once(config, 1), 1)
+        snapshot.publish(self.index_dir, 1, self.publish_dir)
+        self.assertEqual(sync_once(config, 1), 3)
+
+
+#-----------------------------------------------------------------------------#
+class ReplicaTestCase(BaseTestCase):
+    def test_nodes_serve_published_index(self):
+        self._index_doc(u"Test Title", u"Test Text", shards=2)
+        self._index_doc(u"Test Title", u"Test Text", shards=2)
+        snapshot.publish(self.index_dir, 2, self.publish_dir)
+        for node_dir in self.node_dirs:
+            self.assertEqual(snapshot.sync(self.publish_dir, node_dir), 1)
+            indexes = snapshot.Replica(node_dir).indexes()
+            self.assertEqual(len(indexes), 2)
+            self.assertEqual(sum(ix.doc_count() for ix in indexes), 2)
+
+    def test_hot_swap_keeps_old_searchers(self):
+        self._index_doc(u"Test Title", u"Test Text")
+        snapshot.publish(self.index_dir, 1, self.publish_dir)
+        snapshot.sync(self.publish_dir, self.node_dirs[0], keep=1)
+        replica = snapshot.Replica(self.node_dirs[0], check_interval=0)
+        searcher = replica.indexes()[0].searcher()
+
+        self._index_doc(u"Test Title", u"Test Text")
+        snapshot.publish(self.index_dir, 1, self.publish_dir)
+        snapshot.sync(self.publish_dir, self.node_dirs[0], keep=1)
+        self.assertEqual(replica.indexes()[0].doc_count(), 2)
+        self.assertEqual(replica.generation, 2)
+        # The in-flight searcher still sees the generation it started with
+        self.assertEqual(searcher.doc_count(), 1)
+        self.assertEqual(searcher.document(id=1)['title'], u"Test Title")
+        searcher.close()
+
+    def test_suggest_dictionary_rebuilt_in_background(self):
+        self._index_doc(u"Title", u"elephants")
+        snapshot.publish(self.index_dir, 1, self.publish_dir)
+        snapshot.sync(self.publish_dir, self.node_dirs[0])
+        replica = snapshot.Replica(self.node_dirs[0], check_interval=0)
+        try:
+            dictionary = get_dictionary(replica.indexes())
+            self._index_doc(u"Title", u"giraffes")
+            snapshot.publish(self.index_dir, 1, self.publish_dir)
+            snapshot.sync(self.publish_dir, self.node_dirs[0])
+            # The new generation is in a new folder, the old dictionary is
+            # served while it is rebuilt
+            self.assertTrue(get_dictionary(replica.indexes()) is dictionary)
+            dictionary_cache.wait()
+            self.assertEqual(get_dictionary(replica.indexes()).complete(
+                u'gir')[0][0], u'giraffes')
+        finally:
+            dictionary_cache.clear()
+
+    def test_missing_generation_not_created(self):
+        self._index_doc(u"Test Title", u"Test Text")
+        snapshot.publish(self.index_dir, 1, self.publish_dir)
+        snapshot.sync(self.publish_dir, self.node_dirs[0])
+        gen_dir = os.path.join(self.node_dirs[0], 'gen-00000001')
+        shutil.rmtree(gen_dir)
+        replica = snapshot.Replica(self.node_dirs[0])
+        self.assertRaises(IOError, replica.indexes)
+        self.assertFalse(os.path.exists(gen_dir))
+
+    def test_search_api_uses_replica(self):
+        self._index_doc(u"Test Title", u"Test Text")
+        snapshot.publish(self.index_dir, 1, self.publish_dir)
+        snapshot.sync(self.publish_dir, self.node_dirs[0])
+        # Remove the writer's index to prove it isn't being read
+        shutil.rmtree(self.index_dir)
+        app.config['WHOOSH_REPLICA_DIR'] = self.node_dirs[0]
+        rv = self.app.get(u'/api/v1.0/document/search?query=test')
+        rv_json = json.loads(rv.data)
+        self.assertEqual(rv_json[u'meta'][u'total'], 1)
+        self.assertEqual(rv_json[u'hits'][0][u'id'], 1)
@@ -0,0 +1,57 @@
+import json
+import shutil
+import subprocess
+import sys
+import unittest
+
+from app import create_app, db, warm_up
+from app.tests import app
+from app.suggest import dictionary_cache
+
+
+#-----------------------------------------------------------------------------#
+class StartupTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.index_dir = '/tmp/searchr/test_startup_ix'
+        app.config['WHOOSH_INDEX_DIR'] = self.index_dir
+        db.create_all()
+
+    def tearDown(self):
+        app.config['WARM_UP_SUGGEST'] = False
+        dictionary_cache.clear()
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+
+    def test_import_is_lazy(self):
+        loaded = subprocess.check_output([sys.executable, '-c',
+            "import sys, app; print sorted(i for i in ['app.views.api_v1', "
+            "'whoosh'] if i in sys.modules)"])
+        self.assertEqual(loaded.strip(), "[]")
+
+    def test_create_app_settings(self):
+        other = create_app(INDEX_QUEUE='test_settings')
+        self.assertEqual(other.config['INDEX_QUEUE'], 'test_settings')
+        self.assertEqual(other.config['QUERY_CACHE_SIZE'], 1024)
+        db.app = app
+
+    def test_max_content_length(self):
+        other = create_app(DOCUMENT_MAX_LENGTH=1000)
+        db.app = app
+        body = json.dumps({u"title": u"x" * 64,
+                           u"text": u"\U0001f600" * 1000,
+                           u"tags": range(100)})
+        self.assertTrue(other.config['MAX_CONTENT_LENGTH'] >= len(body))
+        other = create_app(MAX_CONTENT_LENGTH=100)
+        db.app = app
+        self.assertEqual(other.config['MAX_CONTENT_LENGTH'], 100)
+
+    def test_warm_up(self):
+        app.config['WARM_UP_SUGGEST'] = True
+        app.extensions.pop('query_cache', None)
+        timings = warm_up(app)
+        self.assertEqual(sorted(timings.keys()),
+                         ['db', 'index', 'parser', 'suggest'])
+        self.assertEqual(len(app.extensions['query_cache']), 1)
@@ -0,0 +1,103 @@
+import json
+import shutil
+import unittest
+
+from app import db
+from app.tests import app
+from app.model.document import Document, get_index
+from app.suggest import TermDictionary, dictionary_cache, get_dictionary
+
+
+#-----------------------------------------------------------------------------#
+class TermDictionaryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dictionary = TermDictionary({u'search': 5, u'searches': 2,
+                                          u'sea': 9, u'season': 3,
+                                          u'tests': 4, u'test': 7},
+                                         limit=3)
+
+    def test_complete_short_prefix(self):
+        self.assertEqual(self.dictionary.complete(u's'),
+                         [(u'sea', 9), (u'search', 5), (u'season', 3)])
+
+    def test_complete_long_prefix(self):
+        self.assertEqual(self.dictionary.complete(u'sear'),
+                         [(u'search', 5), (u'searches', 2)])
+
+    def test_complete_no_match(self):
+        self.assertEqual(self.dictionary.complete(u'zzz'), [])
+
+    def test_correct(self):
+        self.assertEqual(self.dictionary.correct(u'serach'),
+                         [(u'search', 5)])
+        self.assertEqual(self.dictionary.correct(u'tesst'),
+                         [(u'test', 7), (u'tests', 4)])
+
+    def test_did_you_mean(self):
+        self.assertEqual(self.dictionary.did_you_mean([u'serach', u'test']),
+                         u'search test')
+        self.assertEqual(self.dictionary.did_you_mean([u'search']), None)
+
+
+#-----------------------------------------------------------------------------#
+class SuggestAPITestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['INDEX_QUEUE'] = 'test_index'
+        self.index_dir = '/tmp/searchr/test_suggest_ix'
+        app.config['WHOOSH_INDEX_DIR'] = self.index_dir
+        # Rebuild as soon as the index changes
+        app.config['SUGGEST_REBUILD_INTERVAL'] = 0
+        dictionary_cache.clear()
+        self.app = app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        app.config['SUGGEST_REBUILD_INTERVAL'] = 30
+        dictionary_cache.clear()
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+
+    def _index_doc(self, title, text):
+        doc = Document(title, text)
+        db.session.add(doc)
+        db.session.commit()
+        writer = get_index(self.index_dir).writer()
+        writer.update_document(**doc.prepare())
+        writer.commit()
+
+    def _suggest(self, query):
+        rv = self.app.get(u'/api/v1.0/suggest', query_string={'query': query})
+        return json.loads(rv.data)
+
+    def test_completions_from_text_words(self):
+        self._index_doc(u"Title", u"elephants eat elegant leaves")
+        rv_json = self._suggest(u'ele')
+        self.assertEqual([i[u'term'] for i in rv_json[u'completions']],
+                         [u'elegant', u'elephants'])
+
+    def test_dictionary_rebuilt_after_commit(self):
+        self._index_doc(u"Title", u"elephants")
+        self.assertEqual(len(self._suggest(u'gir')[u'completions']), 0)
+        self._index_doc(u"Title", u"giraffes")
+        # The old dictionary is served while the new one is built
+        self.assertEqual(len(self._suggest(u'gir')[u'completions']), 0)
+        dictionary_cache.wait()
+        self.assertEqual(self._suggest(u'gir')[u'completions'][0][u'term'],
+                         u'giraffes')
+
+    def test_rebuild_interval(self):
+        self._index_doc(u"Title", u"elephants")
+        indexes = [get_index(self.index_dir)]
+        dictionary = get_dictionary(indexes, min_interval=3600)
+        self._index_doc(u"Title", u"giraffes")
+        self.assertTrue(get_dictionary(indexes, min_interval=3600)
+                        is dictionary)
+        self.assertFalse(dictionary_cache.building)
+
+    def test_did_you_mean(self):
+        self._index_doc(u"Fast Search", u"Searching text")
+        rv_json = self._suggest(u'fsat serach')
+        self.assertEqual(rv_json[u'did_you_mean'], u'fast search')
@@ -1,15 +1,20 @@
 from flask import current_app
 from datetime import datetime
-from whoosh import index, qparser, highlight
-from whoosh.qparser.dateparse import DateParserPlugin
-from hotqueue import HotQueue
 from flask.ext.restful import Resource, reqparse, fields, marshal, marshal_with,\
-    types
+    types, abort
 
 from app import db
-from app.model.document import Document, get_index
-from app.model.tag import Tag
-from app.lib import tag_list, string_length
+from app.model.document import Document, get_indexes, tag_documents,\
+    untag_documents, index_text, index_size
+from app.model.tag import Tag, tag_cache
+from app.lib import tag_list, string_length, configured_length, field_list,\
+    id_list, LRUCache
+from app.index_queue import IndexQueue
+from app.search import ShardSearcher, QueryError, SortError, parse_query,\
+    WEIGHTINGS, get_weighting
+from app.snapshot import get_replica
+from app.suggest import get_dictionary
+from app.profiling import PhaseTimer, log_slow_query
 
 
 # TODO - Add Auth (see http://flask-httpauth.readthedocs.org/en/latest/)
@@ -64,10 +69,20 @@ PAGINATE_FIELDS = {
     'per_page': fields.Integer
 }
 
+SUGGESTION_FIELDS = {
+    'term': fields.String,
+    'doc_freq': fields.Integer
+}
+
+HIT_FIELDS = ('id', 'title', 'snippet', 'score', 'rank')
+
 IX_FIELDS = {
     'doc_count': fields.Integer,
     'last_modified': fields.DateTime,
-    'is_empty': fields.Boolean
+    'is_empty': fields.Boolean,
+    'shards': fields.Integer,
+    'size': fields.Integer,
+    'bytes_per_doc': fields.Raw
 }
 
 
@@ -75,9 +90,18 @@ IX_FIELDS = {
 # Helper functions
 #-----------------------------------------------------------------------------#
 def _get_index_queue():
-    return HotQueue(current_app.config['INDEX_QUEUE'],
-                    host=current_app.config['REDIS_HOST'],
-                    port=current_app.config['REDIS_PORT'])
+    return IndexQueue(current_app.config['INDEX_QUEUE'],
+                      host=current_app.config['REDIS_HOST'],
+                      port=current_app.config['REDIS_PORT'])
+
+
+def _get_indexes():
+    if current_app.config['WHOOSH_REPLICA_DIR']:
+        replica = get_replica(current_app.config['WHOOSH_REPLICA_DIR'],
+                              current_app.config['WHOOSH_SYNC_INTERVAL'])
+        return replica.indexes()
+    return get_indexes(current_app.config['WHOOSH_INDEX_DIR'],
+                       current_app.config['WHOOSH_INDEX_SHARDS'])
 
 
 def _index_document(doc_id):
@@ -85,33 +109,88 @@ def _index_document(doc_id):
     queue.put(doc_id)
 
 
-def _parse_query(query, schema, default_field):
-    qp = qparser.QueryParser(default_field, schema)
-    qp.add_plugin(DateParserPlugin())
-    qp.add_plugin(qparser.GtLtPlugin())
-    return qp.parse(query)
+def _get_query_cache():
+    if 'query_cache' not in current_app.extensions:
+        size = current_app.config['QUERY_CACHE_SIZE']
+        current_app.extensions['query_cache'] = LRUCache(size)
+    return current_app.extensions['query_cache']
+
+
+def _parse_query(query, schema, default_field=None):
+    """Parse the query, searching the SEARCH_FIELDS if no default field is
+    given."""
+    if default_field is None:
+        default_field = current_app.config['SEARCH_FIELDS']
+    try:
+        return parse_query(query, schema, default_field, _get_query_cache())
+    except QueryError as e:
+        abort(400, message=unicode(e))
+
+
+def _suggestions(suggestions):
+    return [marshal({'term': term, 'doc_freq': freq}, SUGGESTION_FIELDS)
+            for term, freq in suggestions]
+
+
+def _hit_value(hit, fieldname, columns):
+    """Read the field from its column if the index has one, so that the
+    hit's stored fields (including the full text) don't have to be loaded."""
+    key = (id(hit.reader), fieldname)
+    if key not in columns:
+        if hit.reader.has_column(fieldname):
+            columns[key] = hit.reader.column_reader(fieldname)
+        else:
+            columns[key] = None
+    if columns[key] is None:
+        return hit[fieldname]
+    return columns[key][hit.docnum]
 
 
-def _process_results(results):
+def _process_results(results, hit_fields=HIT_FIELDS):
     collated_results = []
+    columns = {}
     for hit in results:
-        res = {'id': hit['id'],
-               'title': hit['title'],
-               'snippet': hit.highlights(u"text"),
-               'score': hit.score,
-               'rank': hit.rank
-               }
+        res = {}
+        for fieldname in hit_fields:
+            if fieldname == 'snippet':
+                res['snippet'] = hit.highlights(
+                    u"text", text=index_text(hit.get(u"text")))
+            elif fieldname == 'score':
+                res['score'] = hit.score
+            elif fieldname == 'rank':
+                res['rank'] = hit.rank
+            else:
+                res[fieldname] = _hit_value(hit, fieldname, columns)
         collated_results.append(res)
     return collated_results
 
 
+def warm_up_caches():
+    """Open the index, build the query parser and connect to the database
+    (and build the suggestion dictionary if WARM_UP_SUGGEST is set). Needs a
+    request context. Returns how long each step took, in ms."""
+    timer = PhaseTimer()
+    with timer.phase('index'):
+        indexes = _get_indexes()
+    with timer.phase('parser'):
+        _parse_query(u'warm up', indexes[0].schema)
+    with timer.phase('db'):
+        db.session.execute("SELECT 1")
+        db.session.remove()
+    if current_app.config['WARM_UP_SUGGEST']:
+        with timer.phase('suggest'):
+            get_dictionary(indexes)
+    return timer.timings
+
+
 #-----------------------------------------------------------------------------#
 # Request Parsers
 #-----------------------------------------------------------------------------#
 doc_parse = reqparse.RequestParser()
 doc_parse.add_argument('title', type=string_length(maximum=64), required=True,
                        location='json')
-doc_parse.add_argument('text', type=unicode, required=True, location='json')
+doc_parse.add_argument('text', type=configured_length('DOCUMENT_MAX_LENGTH'),
+                       required=True, location='json')
 doc_parse.add_argument('tags', type=tag_list, location='json', default=[])
 
 
@@ -131,6 +210,12 @@ tag_parse.add_argument('description', type=string_length(maximum=256),
                        location='json')
 
 
+bulk_tag_parse = reqparse.RequestParser()
+bulk_tag_parse.add_argument('ids', type=id_list, location='json')
+bulk_tag_parse.add_argument('query', type=string_length(minimum=3),
+                            location='json')
+
+
 query_parse = reqparse.RequestParser()
 query_parse.add_argument('page', type=types.natural, location='args', default=1)
 query_parse.add_argument('per_page', type=types.natural, location='args',
@@ -142,6 +227,17 @@ query_parse.add_argument('sort_field', type=unicode, location='args',
                          default=None)
 query_parse.add_argument('reverse', type=types.boolean, location='args',
                          default=False)
+query_parse.add_argument('fields', type=field_list(HIT_FIELDS),
+                         location='args', default=HIT_FIELDS)
+query_parse.add_argument('scoring', type=str, location='args',
+                         choices=sorted(WEIGHTINGS), default=None)
+
+
+suggest_parse = reqparse.RequestParser()
+suggest_parse.add_argument('query', type=string_length(minimum=1),
+                           location='args', required=True)
+suggest_parse.add_argument('limit', type=types.natural, location='args',
+                           default=10)
 
 
 #-----------------------------------------------------------------------------#
@@ -152,6 +248,16 @@ class PingAPI(Resource):
         return {'message': 'Connection tested ok'}
 
 
+class StatsAPI(Resource):
+    """ StatsAPI
+
+        Provides the state of the database connection pools, including how
+        long checkouts have waited for a connection (in ms).
+    """
+    def get(self):
+        return {'db_pools': db.pool_stats()}
+
+
 #-----------------------------------------------------------------------------#
 class DocumentAPI(Resource):
     """ DocumentAPI
@@ -175,7 +281,7 @@ class DocumentAPI(Resource):
 
     @marshal_with(DOCUMENT_FIELDS_ALL)
     def get(self, id):
-        return Document.query.get_or_404(id)
+        return db.read_query(Document).get_or_404(id)
 
     def post(self, id):
         return self._insert(id)
@@ -199,11 +305,14 @@ class DocumentListAPI(Resource):
     """
     def get(self):
         args = filter_parse.parse_args()
-        docs = Document.query.filter_by(deleted=False)
-        docs = docs.paginate(args['page'], args['per_page'], False)
+        docs = db.read_query(Document).filter_by(deleted=False)
         marshal_fields = DOCUMENT_FIELDS_MIN
         if args['details'].lower() == 'all':
             marshal_fields = DOCUMENT_FIELDS_ALL
+        else:
+            # Don't load (and decompress) text that isn't returned
+            docs = docs.options(db.defer(Document.text))
+        docs = docs.paginate(args['page'], args['per_page'], False)
         results = [marshal(i, marshal_fields) for i in docs.items]
         return {'results': results, 'meta': marshal(docs, PAGINATE_FIELDS)}
 
@@ -250,7 +359,7 @@ class TagAPI(Resource):
     """
     @marshal_with(TAG_FIELDS_ALL)
     def get(self, id):
-        return Tag.query.get_or_404(id)
+        return db.read_query(Tag).get_or_404(id)
 
     @marshal_with(TAG_FIELDS_ALL)
     def _insert(self, id):
@@ -263,6 +372,7 @@ class TagAPI(Resource):
             tag.id = id
             db.session.add(tag)
         db.session.commit()
+        tag_cache.invalidate(tag.id)
         return tag
 
     def post(self, id):
@@ -283,7 +393,8 @@ class TagListAPI(Resource):
     """
     def get(self):
         args = filter_parse.parse_args()
-        tags = Tag.query.paginate(args['page'], args['per_page'], False)
+        tags = db.read_query(Tag).paginate(args['page'], args['per_page'],
+                                           False)
         results = [marshal(i, TAG_FIELDS_MIN) for i in tags.items]
         return {'results': results, 'meta': marshal(tags, PAGINATE_FIELDS)}
 
@@ -293,9 +404,48 @@ class TagListAPI(Resource):
         d = Tag(**args)
         db.session.add(d)
         db.session.commit()
+        tag_cache.invalidate(d.id)
         return d
 
 
+class TagDocumentsAPI(Resource):
+    """ TagDocumentsAPI
+
+        Provides the ability to add (POST) or remove (DELETE) a tag for many
+        documents at once, given either a list of document ids or a search
+        query that selects the documents.
+    """
+    def _doc_ids(self):
+        args = bulk_tag_parse.parse_args()
+        if (args['ids'] is None) == (args['query'] is None):
+            abort(400, message="Either ids or query is required")
+        if args['ids'] is not None:
+            return args['ids']
+        indexes = _get_indexes()
+        query, _ = _parse_query(args['query'], indexes[0].schema)
+        with ShardSearcher(indexes) as searcher:
+            return sorted(searcher.matching_values(query, u'id'))
+
+    def _apply(self, tag_id, change):
+        tag = tag_cache.get_many([tag_id]).get(tag_id)
+        if tag is None:
+            abort(404)
+        doc_ids = self._doc_ids()
+        changed = change(tag_id, doc_ids)
+        db.session.commit()
+        if changed:
+            _get_index_queue().put(*changed)
+        return {'tag': marshal(tag, TAG_FIELDS_MIN),
+                'matched': len(doc_ids),
+                'changed': len(changed)}
+
+    def post(self, tag_id):
+        return self._apply(tag_id, tag_documents)
+
+    def delete(self, tag_id):
+        return self._apply(tag_id, untag_documents)
+
+
 #-----------------------------------------------------------------------------#
 class IndexAPI(Resource):
     """ IndexAPI
@@ -305,10 +455,16 @@ class IndexAPI(Resource):
     """
     @marshal_with(IX_FIELDS)
     def get(self):
-        ix = get_index(current_app.config['WHOOSH_INDEX_DIR'])
-        return {'doc_count': ix.doc_count(), 
-                'last_modified': datetime.fromtimestamp(ix.last_modified()),
-                'is_empty': ix.is_empty()
+        indexes = _get_indexes()
+        last_modified = max(ix.last_modified() for ix in indexes)
+        doc_count = sum(ix.doc_count() for ix in indexes)
+        size = sum(index_size(ix) for ix in indexes)
+        return {'doc_count': doc_count,
+                'last_modified': datetime.fromtimestamp(last_modified),
+                'is_empty': all(ix.is_empty() for ix in indexes),
+                'shards': len(indexes),
+                'size': size,
+                'bytes_per_doc': float(size) / doc_count if doc_count else 0.0
                 }
 
     # TODO - Is this even needed anymore. We run a deamon in the background
@@ -323,35 +479,66 @@ class IndexAPI(Resource):
 #-----------------------------------------------------------------------------#
 class SearchAPI(Resource):
     def get(self):
+        timer = PhaseTimer()
         args = query_parse.parse_args()
-        ix = index.open_dir(current_app.config['WHOOSH_INDEX_DIR'])
-        # TODO - Should check that the query is valid and parses at the moment
-        # we just care if it is a unicode string or not.
-        query = _parse_query(args['query'], ix.schema, u'text')
+        indexes = _get_indexes()
+        with timer.phase('parse'):
+            query, query_string = _parse_query(args['query'],
+                                               indexes[0].schema)
+        scoring = args['scoring'] or current_app.config['SEARCH_WEIGHTING']
+        weighting = get_weighting(
+            scoring, current_app.config['WEIGHTING_OPTIONS'].get(scoring))
 
         # TODO - Sort this out it is a bit of a mess
-        with ix.searcher() as searcher:
-            results = searcher.search_page(query,
-                                           args['page'],
-                                           pagelen=args['per_page'],
-                                           terms=True,
-                                           sortedby=args['sort_field'],
-                                           reverse=args['reverse'])
+        with ShardSearcher(indexes, weighting) as searcher:
+            with timer.phase('search'):
+                try:
+                    results = searcher.search_page(
+                        query, args['page'], pagelen=args['per_page'],
+                        terms='snippet' in args['fields'],
+                        sortedby=args['sort_field'], reverse=args['reverse'])
+                except SortError as e:
+                    abort(400, message=unicode(e))
+            with timer.phase('process'):
+                hits = _process_results(results, args['fields'])
             result_dict = {'meta':{ 
                                'page': results.pagenum,
                                'pages': results.pagecount,
                                'per_page': args['per_page'],
                                'total': results.total,
                                'reverse': bool(args['reverse']),
-                               'sort_field': args['sort_field']
+                               'sort_field': args['sort_field'],
+                               'scoring': scoring
                                },
-                           'hits': _process_results(results)
+                           'hits': hits,
+                           'query': query_string
                            }
-            # There are issues converting the parsed query to a unicode string
-            # if it contains the id (a NUMERIC column).
-            # This should be fixed in the next version of Whoosh.
-            try: 
-                result_dict['query'] = unicode(query)
-            except:
-                result_dict['query'] = u':('
-            return result_dict
+        log_slow_query(current_app.config['SLOW_QUERY_THRESHOLD'], timer,
+                       query=args['query'], parsed=query_string,
+                       hits=results.total, page=args['page'],
+                       per_page=args['per_page'],
+                       sort_field=args['sort_field'], scoring=scoring,
+                       shards=len(indexes))
+        return result_dict
+
+
+#-----------------------------------------------------------------------------#
+class SuggestAPI(Resource):
+    """ SuggestAPI
+
+        Provides completions for the last word of the query and corrections
+        for words that are not in the index.
+    """
+    def get(self):
+        args = suggest_parse.parse_args()
+        dictionary = get_dictionary(
+            _get_indexes(), current_app.config['SUGGEST_REBUILD_INTERVAL'])
+        words = args['query'].lower().split()
+        last = words[-1] if words else u''
+        return {'query': args['query'],
+                'completions': _suggestions(dictionary.complete(
+                    last, args['limit'])),
+                'corrections': _suggestions(dictionary.correct(
+                    last, args['limit'])),
+                'did_you_mean': dictionary.did_you_mean(words)
+                }
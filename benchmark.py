@@ -0,0 +1,89 @@
+"""
+   Searchr Server benchmarks
+   -------------------------
+
+   Measures how long a new worker takes to start: importing the app package,
+   creating the app, warming up and serving its first and second requests.
+   Every run is in a new process so nothing is already imported or cached.
+   The app uses the settings in app/config/main.py.
+
+   python benchmark.py [--runs 5] [--url /api/v1.0/document/search?query=test]
+
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+STARTUP = """
+import json, sys, time
+start = time.time()
+import app
+timings = {'import': (time.time() - start) * 1000}
+start = time.time()
+application = app.create_app()
+timings['create_app'] = (time.time() - start) * 1000
+if %(warm_up)r:
+    start = time.time()
+    app.warm_up(application)
+    timings['warm_up'] = (time.time() - start) * 1000
+client = application.test_client()
+for name in ('first_request', 'second_request'):
+    start = time.time()
+    client.get(%(url)r)
+    timings[name] = (time.time() - start) * 1000
+sys.stdout.write(json.dumps(timings))
+"""
+
+COLUMNS = ('import', 'create_app', 'warm_up', 'first_request',
+           'second_request')
+
+
+def run_startup(url, warm_up):
+    """Start a worker in a new process and return its timings, in ms."""
+    output = subprocess.check_output(
+        [sys.executable, '-c', STARTUP % {'url': url, 'warm_up': warm_up}],
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(output)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def benchmark_startup(runs, url):
+    """Return the median timings of runs starts, with and without warming
+    up."""
+    results = {}
+    for warm_up in (False, True):
+        timings = [run_startup(url, warm_up) for i in range(runs)]
+        results[warm_up] = dict((i, median([t[i] for t in timings]))
+                                for i in COLUMNS if i in timings[0])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Searchr startup benchmark")
+    parser.add_argument('--runs', type=int, default=5,
+                        help="number of times to start a worker")
+    parser.add_argument('--url', default='/api/v1.0/document/search?query=test',
+                        help="the url requested")
+    args = parser.parse_args()
+
+    results = benchmark_startup(args.runs, args.url)
+    print "Median of {} runs, in ms".format(args.runs)
+    print "{:<10}".format('') + "".join("{:>16}".format(i) for i in COLUMNS)
+    for warm_up, label in ((False, 'cold'), (True, 'warmed up')):
+        print "{:<10}".format(label) + "".join(
+            "{:>16.1f}".format(results[warm_up][i]) if i in results[warm_up]
+            else "{:>16}".format('-') for i in COLUMNS)
+
+
+if __name__ == '__main__':
+    main()
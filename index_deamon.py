@@ -2,41 +2,310 @@
    Searchr Server index deamon
    ---------------------------
 
-   The Searchr index deamon ... # TODO - Write some better docs this
+   The Searchr index deamon takes document ids off the index queue and writes
+   the documents to the index.
 
+   Ids are reserved from the queue in batches. A pool of worker processes
+   fetches and prepares the documents, each shard's part of the batch is
+   written and committed in its own thread, and only then are the ids acked.
+   Ids from a batch that fails are retried after a backoff. SIGTERM and SIGINT
+   let the current batch finish before the deamon exits.
+
+   Run with --daemon to detach from the terminal.
 """
-from whoosh.writing import BufferedWriter
-from hotqueue import HotQueue
+import argparse
+import logging
+import os
+import signal
+import threading
+import time
+from itertools import chain
+from multiprocessing import Pool, TimeoutError
 
-from app.model.document import get_index, Document
-from app.config import main as main_config
+from redis.exceptions import ConnectionError
 
+from app import create_app, db
+from app.model.document import get_indexes, shard_for, Document
+from app import snapshot
+from app.index_queue import IndexQueue
+from app.reconcile import write_high_water_mark
+from app.profiling import Profile, sampled
 
-def write_doc(doc, writer):
-    if doc.deleted:
-        print "deleting {}".format(doc.id)
-        writer.delete_by_term('id', unicode(doc.id))
-    else:
-        print "updating {}".format(doc.id)
-        writer.update_document(**doc.prepare())
 
+log = logging.getLogger('searchr.index_deamon')
 
-def main():
-    queue = HotQueue(main_config.INDEX_QUEUE, 
-                     host=main_config.REDIS_HOST, 
-                     port=main_config.REDIS_PORT)
-    index = get_index(main_config.WHOOSH_INDEX_DIR)
-    writer = BufferedWriter(index, limit=10)
+
+#-----------------------------------------------------------------------------#
+# Workers
+#-----------------------------------------------------------------------------#
+def init_worker():
+    """Set up a worker process. Database connections can't be shared with the
+    parent, and signals are left for the parent to handle."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    db.engine.dispose()
+
+
+def fetch_docs(doc_ids):
+    """Return a (doc_id, fields) tuple for each id, where fields is None if the
+    document has been deleted or no longer exists."""
     try:
-        for doc_id in queue.consume():
-            print "looking at {}".format(doc_id)
-            doc = Document.query.get(doc_id)
-            if doc:
-                write_doc(doc, writer)
+        query = Document.query.options(db.subqueryload('tags'))\
+                              .filter(Document.id.in_(doc_ids))
+        docs = dict((doc.id, doc) for doc in query)
+        results = []
+        for doc_id in doc_ids:
+            doc = docs.get(doc_id)
+            if doc is None or doc.deleted:
+                results.append((doc_id, None))
             else:
-                print "no doc with doc_id {}".format(doc_id)
+                results.append((doc_id, doc.prepare()))
+        return results
     finally:
-       writer.close()
+        db.session.remove()
+
+
+#-----------------------------------------------------------------------------#
+# Writing
+#-----------------------------------------------------------------------------#
+def write_shard(ix, docs, deletes, procs=1):
+    """Write the prepared docs and deletes to one shard and commit. With
+    procs > 1 the documents are analysed in that many processes."""
+    writer = ix.writer(procs=procs) if procs > 1 else ix.writer()
+    try:
+        for fields in docs:
+            writer.update_document(**fields)
+        for doc_id in deletes:
+            writer.delete_by_term('id', unicode(doc_id))
+    except:
+        writer.cancel()
+        raise
+    writer.commit()
+
+
+def write_batch(indexes, prepared, procs=1):
+    """Write the (doc_id, fields) tuples to their shards. Each shard is written
+    in its own thread so the shards are committed in parallel."""
+    by_shard = [([], []) for ix in indexes]
+    for doc_id, fields in prepared:
+        docs, deletes = by_shard[shard_for(doc_id, len(indexes))]
+        if fields is None:
+            deletes.append(doc_id)
+        else:
+            docs.append(fields)
+
+    errors = []
+    def _write(shard):
+        try:
+            docs, deletes = by_shard[shard]
+            write_shard(indexes[shard], docs, deletes, procs)
+        except Exception as e:
+            log.exception("Writing to shard %s failed", shard)
+            errors.append(e)
+
+    threads = [threading.Thread(target=_write, args=(i,))
+               for i, (docs, deletes) in enumerate(by_shard)
+               if docs or deletes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+#-----------------------------------------------------------------------------#
+# Deamon
+#-----------------------------------------------------------------------------#
+def start_profile(config):
+    """Start profiling the next batch if it is picked for profiling. Only the
+    main process is profiled."""
+    if config['PROFILE_ENABLED'] and sampled(config['PROFILE_SAMPLE_RATE']):
+        profile = Profile('index_deamon', config['PROFILE_DIR'])
+        profile.start()
+        return profile
+    return None
+
+
+class IndexDeamon(object):
+    """Indexes batches of ids from the index queue until it is stopped."""
+    def __init__(self, config):
+        self.config = config
+        self.queue = IndexQueue(config['INDEX_QUEUE'],
+                                host=config['REDIS_HOST'],
+                                port=config['REDIS_PORT'],
+                                max_retries=config['INDEX_MAX_RETRIES'],
+                                backoff=config['INDEX_RETRY_BACKOFF'])
+        self.indexes = get_indexes(config['WHOOSH_INDEX_DIR'],
+                                   config['WHOOSH_INDEX_SHARDS'])
+        self.pool = None
+        self.running = False
+        self.unpublished = False
+        self.last_publish = 0
+
+    def start_pool(self):
+        if self.config['INDEX_WORKERS'] > 0:
+            self.pool = Pool(self.config['INDEX_WORKERS'], init_worker)
+
+    def restart_pool(self):
+        """Replace the worker pool, e.g. after a worker has hung."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        self.start_pool()
+
+    def fetch(self, doc_ids):
+        """Fetch and prepare the documents, split between the workers. With no
+        workers the documents are fetched in this process."""
+        if self.pool is None:
+            return fetch_docs(doc_ids)
+        workers = self.config['INDEX_WORKERS']
+        chunks = [doc_ids[i::workers] for i in range(workers)]
+        result = self.pool.map_async(fetch_docs, [i for i in chunks if i])
+        return list(chain(*result.get(self.config['INDEX_WORKER_TIMEOUT'])))
+
+    def process(self, doc_ids):
+        """Index a batch of reserved ids. The ids are acked once the batch has
+        been committed, or scheduled to be retried if anything fails."""
+        try:
+            prepared = self.fetch(sorted(set(doc_ids)))
+            write_batch(self.indexes, prepared,
+                        self.config['INDEX_WRITER_PROCS'])
+        except TimeoutError:
+            log.error("Timed out fetching %s documents, restarting workers",
+                      len(doc_ids))
+            self.restart_pool()
+            self.fail(doc_ids)
+            return False
+        except Exception:
+            log.exception("Indexing %s documents failed", len(doc_ids))
+            self.fail(doc_ids)
+            return False
+
+        # The batch is committed, so failures from here on are logged rather
+        # than retrying it
+        self.unpublished = True
+        updated = [fields['updated'] for _, fields in prepared
+                   if fields is not None and fields['updated'] is not None]
+        if updated:
+            try:
+                write_high_water_mark(self.config['WHOOSH_INDEX_DIR'],
+                                      max(updated))
+            except (OSError, IOError):
+                log.exception("Writing the high water mark failed")
+        try:
+            self.queue.ack(*doc_ids)
+        except ConnectionError:
+            # The ids are requeued by recover() when the deamon next starts
+            log.exception("Acking %s documents failed", len(doc_ids))
+        log.info("Indexed %s documents", len(prepared))
+        return True
+
+    def fail(self, doc_ids):
+        for doc_id in doc_ids:
+            if not self.queue.retry(doc_id):
+                log.error("Giving up on document %s", doc_id)
+
+    def publish(self, force=False):
+        """Publish the index if it has changed, at most once every
+        INDEX_PUBLISH_PERIOD seconds unless forced."""
+        if not self.config['WHOOSH_PUBLISH_DIR'] or not self.unpublished:
+            return
+        if not force and time.time() - self.last_publish < \
+           self.config['INDEX_PUBLISH_PERIOD']:
+            return
+        try:
+            generation = snapshot.publish(
+                self.config['WHOOSH_INDEX_DIR'], len(self.indexes),
+                self.config['WHOOSH_PUBLISH_DIR'],
+                self.config['WHOOSH_KEEP_GENERATIONS'])
+        except (OSError, IOError):
+            # Tried again after another INDEX_PUBLISH_PERIOD
+            log.exception("Publishing to %s failed",
+                          self.config['WHOOSH_PUBLISH_DIR'])
+            self.last_publish = time.time()
+            return
+        log.info("Published generation %s", generation)
+        self.last_publish = time.time()
+        self.unpublished = False
+
+    def stop(self, signum=None, frame=None):
+        log.info("Stopping once the current batch is finished")
+        self.running = False
+
+    def run_once(self):
+        """Process the next batch from the queue, if there is one."""
+        self.queue.promote_delayed()
+        doc_ids = self.queue.reserve(self.config['INDEX_BATCH_SIZE'])
+        if doc_ids:
+            profile = start_profile(self.config)
+            try:
+                self.process(doc_ids)
+            finally:
+                if profile is not None:
+                    log.info("Profile written to %s", profile.stop())
+        self.publish()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        recovered = self.queue.recover()
+        if recovered:
+            log.info("Requeued %s documents left by the last run", recovered)
+        self.start_pool()
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    self.run_once()
+                except ConnectionError:
+                    # A signal interrupting the blocking reserve ends up here
+                    if self.running:
+                        log.exception("Lost the connection to Redis")
+                        time.sleep(1)
+                except Exception:
+                    log.exception("Unexpected error, carrying on")
+                    time.sleep(1)
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+            self.publish(force=True)
+            log.info("Stopped")
+
+
+#-----------------------------------------------------------------------------#
+# Running
+#-----------------------------------------------------------------------------#
+def daemonize(pidfile=None):
+    """Detach from the terminal with the usual double fork."""
+    if os.fork():
+        os._exit(0)
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    if pidfile:
+        with open(pidfile, 'w') as f:
+            f.write('{}\n'.format(os.getpid()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Searchr index deamon")
+    parser.add_argument('--daemon', action='store_true',
+                        help="detach from the terminal")
+    parser.add_argument('--pidfile', help="file to write the pid to")
+    parser.add_argument('--log-file', help="file to log to instead of stderr")
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log_file, level=logging.INFO,
+                        format='%(asctime)s %(process)d %(levelname)s '
+                               '%(message)s')
+    if args.daemon:
+        daemonize(args.pidfile)
+    IndexDeamon(create_app().config).run()
 
 
 if __name__ == '__main__':
@@ -15,6 +15,11 @@ import unittest
 nav = navigator.Navigator(intro="Searchr Manager")
 
 
+def get_app():
+    from app import create_app
+    return create_app()
+
+
 #-----------------------------------------------------------------------------#
 # Routes
 #-----------------------------------------------------------------------------#
@@ -22,16 +27,82 @@ nav = navigator.Navigator(intro="Searchr Manager")
 @nav.route("Create Database", "Creates the Database")
 def create_db():
     from app import db
+    get_app()
     navigator.ui.text_info("Trying to create the Database")
     db.create_all()
+    create_missing_indexes(db)
     navigator.ui.text_success("Database created")
 
 
+def create_missing_indexes(db):
+    """create_all skips tables that already exist, so add any indexes that
+    have been added to the models since the Database was created."""
+    from sqlalchemy import inspect
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = set(i['name'] for i in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                navigator.ui.text_info("Creating index {}".format(index.name))
+                index.create(bind=db.engine)
+
+
+@nav.route("Purge Deleted Documents", "Permanently remove documents that "
+           "were deleted more than PURGE_DELETED_AFTER days ago")
+def purge_deleted_documents():
+    from datetime import datetime, timedelta
+    app = get_app()
+    from app.model.document import purge_deleted
+    days = app.config['PURGE_DELETED_AFTER']
+    navigator.ui.text_info("Purging documents deleted over {} days "
+                           "ago".format(days))
+    purged = purge_deleted(datetime.utcnow() - timedelta(days=days))
+    navigator.ui.text_success("{} documents purged".format(purged))
+
+
+@nav.route("Reconcile Index", "Queue documents that are new, changed, deleted "
+           "or missing from the index")
+def reconcile_index():
+    app = get_app()
+    from app.index_queue import IndexQueue
+    from app.model.document import get_indexes
+    from app.reconcile import reconcile, read_high_water_mark
+    navigator.ui.text_info("Comparing the Database with the index")
+    queue = IndexQueue(app.config['INDEX_QUEUE'],
+                       host=app.config['REDIS_HOST'],
+                       port=app.config['REDIS_PORT'])
+    indexes = get_indexes(app.config['WHOOSH_INDEX_DIR'],
+                          app.config['WHOOSH_INDEX_SHARDS'])
+    high_water_mark = read_high_water_mark(app.config['WHOOSH_INDEX_DIR'])
+    batch, counts = [], {}
+    for doc_id, reason in reconcile(indexes, high_water_mark):
+        batch.append(doc_id)
+        counts[reason] = counts.get(reason, 0) + 1
+        if len(batch) >= 1000:
+            queue.put(*batch)
+            batch = []
+    if batch:
+        queue.put(*batch)
+    for reason, count in sorted(counts.items()):
+        navigator.ui.text_info("{} {} documents queued".format(count, reason))
+    navigator.ui.text_success("Index reconciled")
+
+
 @nav.route("Run Tests", "Run all the Unit Tests")
 def run_unit_tests():
     navigator.ui.text_info("Running Unit Tests")
     test_list = ['app.tests.lib',
-                 'app.tests.api_v1']
+                 'app.tests.api_v1',
+                 'app.tests.search',
+                 'app.tests.snapshot',
+                 'app.tests.reconcile',
+                 'app.tests.document',
+                 'app.tests.suggest',
+                 'app.tests.profiling',
+                 'app.tests.index_queue',
+                 'app.tests.database',
+                 'app.tests.startup',
+                 'app.tests.request_replay']
     tests = unittest.TestLoader().loadTestsFromNames(test_list)
     results = unittest.TextTestRunner().run(tests)
     if results.wasSuccessful():
@@ -0,0 +1,206 @@
+"""
+   Searchr Server request replay
+   -----------------------------
+
+   Replays a log of requests against the API and reports the throughput and
+   latency percentiles of each endpoint. The log is JSON lines, one request
+   per line:
+
+      {"method": "GET", "path": "/api/v1.0/document/search?query=test"}
+      {"method": "POST", "path": "/api/v1.0/document", "body": {...}}
+
+   method defaults to GET, and lines without a path are skipped. Requests are
+   sent in process through the test client (using the settings in
+   app/config/main.py) unless --url is given.
+
+   python replay.py requests.jsonl [--url http://localhost:8081]
+                    [--concurrency 4] [--rate 50] [--repeat 1]
+
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import urllib2
+from collections import defaultdict
+
+
+#-----------------------------------------------------------------------------#
+# Requests
+#-----------------------------------------------------------------------------#
+def read_log(lines):
+    """Return a (method, path, body) tuple for each request in the log."""
+    requests = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        entry = json.loads(line)
+        if 'path' not in entry:
+            continue
+        requests.append((entry.get('method', 'GET').upper(), entry['path'],
+                         entry.get('body')))
+    return requests
+
+
+def endpoint_name(method, path):
+    """Group requests by method and path, without the query string and with
+    ids replaced, e.g. GET /api/v1.0/document/<id>."""
+    path = path.split('?', 1)[0].rstrip('/')
+    return u'{} {}'.format(method, re.sub(r'/\d+(?=/|$)', '/<id>', path))
+
+
+class InProcessTarget(object):
+    """Sends requests to the app through its test client."""
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def send(self, method, path, body=None):
+        """Send the request and return the status code."""
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        kwargs = {'method': method}
+        if body is not None:
+            kwargs.update(data=json.dumps(body),
+                          content_type='application/json')
+        return self.local.client.open(path, **kwargs).status_code
+
+
+class HTTPTarget(object):
+    """Sends requests to a running server."""
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def send(self, method, path, body=None):
+        """Send the request and return the status code."""
+        data = json.dumps(body) if body is not None else None
+        request = urllib2.Request(self.url + path, data=data)
+        request.get_method = lambda: method
+        if data is not None:
+            request.add_header('Content-Type', 'application/json')
+        try:
+            response = urllib2.urlopen(request, timeout=self.timeout)
+            response.read()
+            return response.getcode()
+        except urllib2.HTTPError as e:
+            return e.code
+
+
+#-----------------------------------------------------------------------------#
+# Replay
+#-----------------------------------------------------------------------------#
+def percentile(values, pct):
+    """The nearest rank percentile of the sorted values."""
+    if not values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(values))), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+def replay(target, requests, concurrency=1, rate=None):
+    """Send the requests using concurrency threads. If rate is set requests
+    are started at that many per second in total, otherwise as fast as the
+    threads can send them.
+
+    Returns a dict of endpoint name to a list of (latency in ms, status code)
+    tuples, and the time taken in seconds."""
+    results = defaultdict(list)
+    lock = threading.Lock()
+    position = [0]
+    start = time.time()
+
+    def _next():
+        with lock:
+            i = position[0]
+            position[0] += 1
+        return i
+
+    def _worker():
+        while True:
+            i = _next()
+            if i >= len(requests):
+                return
+            if rate:
+                delay = start + i / float(rate) - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            method, path, body = requests[i]
+            sent = time.time()
+            try:
+                status = target.send(method, path, body)
+            except Exception:
+                status = None
+            latency = (time.time() - sent) * 1000
+            with lock:
+                results[endpoint_name(method, path)].append((latency, status))
+
+    threads = [threading.Thread(target=_worker) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.time() - start
+
+
+def summarise(results, elapsed):
+    """Return a row of stats for each endpoint, and one for all of them."""
+    rows = []
+    everything = []
+    for name in sorted(results):
+        rows.append(_summarise_endpoint(name, results[name], elapsed))
+        everything.extend(results[name])
+    rows.append(_summarise_endpoint(u'all', everything, elapsed))
+    return rows
+
+
+def _summarise_endpoint(name, results, elapsed):
+    latencies = sorted(i[0] for i in results)
+    errors = len([i for i in results if i[1] is None or i[1] >= 500])
+    return {'endpoint': name,
+            'requests': len(results),
+            'errors': errors,
+            'throughput': len(results) / elapsed if elapsed else 0.0,
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Searchr request replay")
+    parser.add_argument('log', help="JSON lines file of requests")
+    parser.add_argument('--url', help="server to send the requests to, "
+                        "instead of the app in this process")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="number of requests in flight at once")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="requests started per second")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="number of times to replay the log")
+    args = parser.parse_args()
+
+    with open(args.log) as f:
+        requests = read_log(f) * args.repeat
+    if args.url:
+        target = HTTPTarget(args.url)
+    else:
+        from app import create_app, warm_up
+        app = create_app()
+        warm_up(app)
+        target = InProcessTarget(app)
+
+    results, elapsed = replay(target, requests, args.concurrency, args.rate)
+    print "{} requests in {:.2f}s, latencies in ms".format(len(requests),
+                                                           elapsed)
+    print "{:<45}{:>9}{:>8}{:>9}{:>9}{:>9}{:>9}{:>9}".format(
+        'endpoint', 'requests', 'errors', 'req/s', 'p50', 'p90', 'p99', 'max')
+    for row in summarise(results, elapsed):
+        print ("{endpoint:<45}{requests:>9}{errors:>8}{throughput:>9.1f}"
+               "{p50:>9.1f}{p90:>9.1f}{p99:>9.1f}{max:>9.1f}").format(**row)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
 #-----------------------------------------------------------------------------#
 # Run the Dev Server
 #-----------------------------------------------------------------------------#
-from app import app
+from app import create_app, warm_up
 
 if __name__ == '__main__':
-    app.config['DEBUG'] = True
+    app = create_app(DEBUG=True)
+    warm_up(app)
     app.run('0.0.0.0', 8081)
@@ -0,0 +1,54 @@
+"""
+   Searchr Server sync deamon
+   --------------------------
+
+   Run on each search node to copy the newest index generation published by
+   the index deamon from WHOOSH_PUBLISH_DIR to WHOOSH_REPLICA_DIR. The web
+   workers on the node swap to a new generation once it has been synced.
+
+   A sync that fails, e.g. because the generation being copied was pruned by
+   the publisher, is logged and tried again after WHOOSH_SYNC_INTERVAL.
+"""
+import argparse
+import logging
+import time
+
+from app import create_app
+from app import snapshot
+
+
+log = logging.getLogger('searchr.sync_deamon')
+
+
+def sync_once(config, generation=None):
+    """Sync the newest published generation. Returns the generation synced,
+    or the given generation if the sync failed."""
+    try:
+        synced = snapshot.sync(config['WHOOSH_PUBLISH_DIR'],
+                               config['WHOOSH_REPLICA_DIR'],
+                               config['WHOOSH_KEEP_GENERATIONS'])
+    except (OSError, IOError):
+        log.exception("Syncing from %s failed", config['WHOOSH_PUBLISH_DIR'])
+        return generation
+    if synced != generation:
+        log.info("Synced generation %s", synced)
+    return synced
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Searchr sync deamon")
+    parser.add_argument('--log-file', help="file to log to instead of stderr")
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log_file, level=logging.INFO,
+                        format='%(asctime)s %(process)d %(levelname)s '
+                               '%(message)s')
+    config = create_app().config
+    generation = None
+    while True:
+        generation = sync_once(config, generation)
+        time.sleep(config['WHOOSH_SYNC_INTERVAL'])
+
+
+if __name__ == '__main__':
+    main()
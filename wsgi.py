@@ -0,0 +1,14 @@
+"""
+   Searchr Server WSGI entry point
+   -------------------------------
+
+   For running under a WSGI server, e.g. `gunicorn wsgi:app`. Each worker
+   opens the index and fills its caches as it loads this module, before it
+   takes any requests.
+
+"""
+from app import create_app, warm_up
+
+
+app = create_app()
+warm_up(app)